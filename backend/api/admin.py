@@ -1,17 +1,40 @@
 import os
 from flask_admin import Admin
-from api.models import db, User, Product, Order, CartItem
+from api.models import db, User, Product, Order, CartItem, Category
+from api.invalidation import publish, product_changed
 from flask_admin.contrib.sqla import ModelView
 
+
+class CacheAwareModelView(ModelView):
+    """ModelView that publishes cache invalidations for admin panel writes."""
+
+    def publish_change(self, model):
+        if isinstance(model, Product):
+            if model.id is None:
+                self.session.flush()
+            product_changed(model.id)
+        elif isinstance(model, Category):
+            publish('categories', 'products')
+        elif isinstance(model, User):
+            publish(f'user:{model.id}')
+
+    def on_model_change(self, form, model, is_created):
+        self.publish_change(model)
+
+    def on_model_delete(self, model):
+        self.publish_change(model)
+
+
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='Onix 2.0 Admin', template_mode='bootstrap3')
     
     # Add administrative views here
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Product, db.session))
+    admin.add_view(CacheAwareModelView(User, db.session))
+    admin.add_view(CacheAwareModelView(Product, db.session))
+    admin.add_view(CacheAwareModelView(Category, db.session))
     admin.add_view(ModelView(Order, db.session))
     admin.add_view(ModelView(CartItem, db.session))
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
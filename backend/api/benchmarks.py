@@ -0,0 +1,391 @@
+"""
+Benchmarks run against the configured DATABASE_URL. Every command seeds its own
+synthetic rows inside a transaction and rolls it back at the end, so they can be
+pointed at a development copy of the database without leaving data behind.
+"""
+
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import click
+from sqlalchemy import event, insert, or_
+
+from api.models import db, User, Product, ProductVariant, Category, CartItem, Order, OrderItem
+from api.search import apply_search, rebuild_search_index
+from api.inventory import distribute_stock, take_sharded_stock
+
+WORDS = [
+    'anillo', 'collar', 'pulsera', 'pendiente', 'broche', 'plata', 'oro', 'acero', 'perla', 'cuarzo',
+    'luna', 'sol', 'estrella', 'flor', 'hoja', 'corazon', 'trenzado', 'minimal', 'vintage', 'clasico',
+    'fino', 'grueso', 'largo', 'corto', 'doble', 'cadena', 'cristal', 'nacar', 'azul', 'rosa'
+]
+RARE_WORD = 'esmeralda'
+
+
+def seed_products(start, count, chunk_size=10000):
+    rng = random.Random(start)
+    with_tags = db.session.get_bind().dialect.name == 'postgresql'  # ARRAY columns are Postgres only
+    for offset in range(start, start + count, chunk_size):
+        rows = []
+        for i in range(offset, min(offset + chunk_size, start + count)):
+            name_words = rng.sample(WORDS, 3)
+            description_words = rng.sample(WORDS, 8)
+            if i % 1000 == 0:
+                description_words.append(RARE_WORD)
+            rows.append({
+                "name": ' '.join(name_words).title(),
+                "slug": f"bench-{i}",
+                "description": ' '.join(description_words),
+                "price": rng.randint(500, 50000) / 100,
+                "stock_quantity": rng.randint(0, 100),
+                "is_featured": i % 50 == 0,
+                "tags": rng.sample(WORDS, 2) if with_tags else None
+            })
+        db.session.execute(insert(Product), rows)
+
+
+def time_query(build_query, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        query = build_query()
+        query.limit(12).all()
+        query.order_by(None).count()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def hot_queries():
+    sample_id = uuid.UUID(int=1)
+    queries = [
+        ('products listing', ('ix_products_active_created',),
+         Product.query.filter_by(is_active=True).order_by(Product.created_at.desc(), Product.id.desc()).limit(12)),
+        ('products by category', ('ix_products_category_active_created',),
+         Product.query.filter_by(is_active=True, category_id=sample_id).order_by(Product.created_at.desc()).limit(12)),
+        ('featured products', ('ix_products_featured_created',),
+         Product.query.filter_by(is_active=True, is_featured=True).order_by(Product.created_at.desc()).limit(12)),
+        ('cart line lookup', ('ix_cart_items_user_product',),
+         CartItem.query.filter_by(user_id=sample_id, product_id=sample_id)),
+        ('order history', ('ix_orders_user_created',),
+         Order.query.filter_by(user_id=sample_id).order_by(Order.created_at.desc())),
+        ('order items', ('ix_order_items_order',),
+         OrderItem.query.filter_by(order_id=sample_id)),
+        ('category by slug', ('categories_slug_key', 'sqlite_autoindex_categories'),
+         Category.query.filter_by(slug='anillos', is_active=True)),
+        ('category subtree', ('ix_categories_path',),
+         Category.query.filter(Category.path.like('/' + sample_id.hex + '/%'), Category.is_active.is_(True))),
+        ('active categories', ('ix_categories_active_sort',),
+         Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name)),
+        ('products by price ascending', ('ix_products_active_price',),
+         Product.query.filter_by(is_active=True).order_by(Product.price.asc(), Product.id.asc()).limit(12)),
+        ('products by price descending', ('ix_products_active_price',),
+         Product.query.filter_by(is_active=True).order_by(Product.price.desc(), Product.id.desc()).limit(12)),
+        ('products in price range', ('ix_products_active_price',),
+         Product.query.filter_by(is_active=True).filter(Product.price >= 25, Product.price <= 100)
+         .order_by(Product.price.asc(), Product.id.asc()).limit(12)),
+    ]
+    if db.session.get_bind().dialect.name == 'postgresql':
+        queries += [
+            ('products with any tag', ('ix_products_tags',),
+             Product.query.filter_by(is_active=True).filter(Product.tags.overlap(['plata', 'oro']))),
+            ('products with all tags', ('ix_products_tags',),
+             Product.query.filter_by(is_active=True).filter(Product.tags.contains(['plata', 'oro']))),
+        ]
+    return queries
+
+
+@contextmanager
+def count_statements():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = db.session.get_bind()
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def seed_cart(lines):
+    user = User(email=f'bench-{uuid.uuid4().hex}@onix.com', password_hash='-', first_name='Bench', last_name='User')
+    db.session.add(user)
+    for i in range(lines):
+        product = Product(name=f'Bench cart {i}', slug=f'bench-cart-{uuid.uuid4().hex}', price=10 + i, stock_quantity=100)
+        variant = ProductVariant(product=product, name='Talla única', stock_quantity=100) if i % 2 else None
+        db.session.add(CartItem(user=user, product=product, product_variant=variant, quantity=1 + i % 3, price=product.price))
+    db.session.flush()
+    db.session.expunge_all()
+    return user.id
+
+
+def seed_orders(user_id, orders, lines):
+    products = [Product(name=f'Bench order {i}', slug=f'bench-order-{uuid.uuid4().hex}', price=10 + i,
+                        stock_quantity=100, image_url=f'https://example.com/{i}.jpg') for i in range(lines)]
+    db.session.add_all(products)
+    for n in range(orders):
+        order = Order(order_number=f'BENCH-{uuid.uuid4().hex[:12]}', user_id=user_id, shipping_address={})
+        for product in products:
+            order.order_items.append(OrderItem(
+                product=product, quantity=1, price=product.price, total=product.price,
+                product_snapshot={"name": product.name, "image_url": product.image_url, "price": float(product.price)}
+            ))
+        db.session.add(order)
+    db.session.flush()
+    order_id = order.id
+    db.session.expunge_all()
+    return order_id
+
+
+def explain(query):
+    dialect = db.session.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(db.text(prefix + sql)).fetchall()
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def setup_benchmarks(app):
+
+    @app.cli.command('check-indexes')
+    @click.option('--verbose', is_flag=True, help='Muestra el plan completo de cada consulta')
+    def check_indexes(verbose):
+        """EXPLAIN each hot query shape and check it uses its index."""
+        missing = []
+        try:
+            if db.session.get_bind().dialect.name == 'postgresql':
+                # Small tables would make the planner prefer a seq scan; we only
+                # want to know whether the index can serve the query.
+                db.session.execute(db.text('SET LOCAL enable_seqscan = off'))
+            else:
+                # Without statistics SQLite picks the first usable index it finds.
+                db.session.execute(db.text('ANALYZE'))
+            for label, index_names, query in hot_queries():
+                plan = explain(query)
+                uses_index = any(index_name in plan for index_name in index_names)
+                if not uses_index:
+                    missing.append(label)
+                print(f"{'✅' if uses_index else '❌'} {label}: {' / '.join(index_names)}")
+                if verbose or not uses_index:
+                    print('    ' + plan.replace('\n', '\n    '))
+        finally:
+            db.session.rollback()
+        if missing:
+            raise click.ClickException(f"Consultas sin índice: {', '.join(missing)}")
+
+    @app.cli.command('check-queries')
+    @click.option('--lines', default=20, help='Líneas del carrito y de cada orden de prueba')
+    @click.option('--orders', default=30, help='Órdenes del historial de prueba')
+    def check_queries(lines, orders):
+        """Count the statements issued by the hot read paths."""
+        from api.routes import _load_cart, _load_order_summaries, _load_order, _load_order_products
+
+        failed = []
+        try:
+            user_id = seed_cart(lines)
+            order_id = seed_orders(user_id, orders, lines)
+
+            def order_detail_with_products():
+                order = _load_order(user_id, order_id)
+                return order.serialize(_load_order_products(order))
+
+            checks = [
+                ('cart read', 1, lambda: [item.serialize() for item in _load_cart(user_id)[0]]),
+                ('order history page', 1, lambda: _load_order_summaries(user_id, per_page=20)),
+                ('order detail', 1, lambda: _load_order(user_id, order_id).serialize()),
+                ('order detail with products', 2, order_detail_with_products),
+            ]
+            for label, budget, run in checks:
+                with count_statements() as statements:
+                    run()
+                db.session.expunge_all()
+                ok = len(statements) <= budget
+                if not ok:
+                    failed.append(label)
+                print(f"{'✅' if ok else '❌'} {label}: {len(statements)} consultas (máximo {budget})")
+                if not ok:
+                    for statement in statements:
+                        print('    ' + ' '.join(statement.split())[:160])
+        finally:
+            db.session.rollback()
+        if failed:
+            raise click.ClickException(f"Consultas por encima del límite: {', '.join(failed)}")
+
+    @app.cli.command('bench-checkout')
+    @click.option('--sizes', default='1,10,50,200', help='Líneas del carrito a comparar, separadas por comas')
+    def bench_checkout(sizes):
+        """Statements and time to turn carts of each size into an order.
+
+        The order is never committed, so COMMIT and the NOTIFY delivery are not
+        timed; the statements are all the request issues before it.
+        """
+        from api.routes import _load_cart, _create_order
+        from api.inventory import take_stock
+
+        print(f"{'lines':>6} {'statements':>11} {'ms':>8}")
+        for lines in sorted(int(size) for size in sizes.split(',')):
+            try:
+                user_id = seed_cart(lines)
+                with count_statements() as statements:
+                    started = time.perf_counter()
+                    cart_items, subtotal, _ = _load_cart(user_id)
+                    take_stock(user_id, cart_items)
+                    _create_order(user_id, cart_items, subtotal, {'payment_intent_id': 'pi_bench', 'shipping_address': {}})
+                    db.session.flush()  # count writes the session still holds, like the invalidation row
+                    elapsed = (time.perf_counter() - started) * 1000
+                print(f"{lines:>6} {len(statements):>11} {elapsed:>8.1f}")
+            finally:
+                db.session.rollback()
+
+    @app.cli.command('bench-stock')
+    @click.option('--shards', default='1,4,16', help='Números de filas de stock a comparar, separados por comas')
+    @click.option('--threads', default=16, help='Checkouts concurrentes')
+    @click.option('--checkouts', default=2000, help='Checkouts por prueba')
+    def bench_stock(shards, threads, checkouts):
+        """Checkout throughput on one hot product with 1 vs N stock shards.
+
+        Unlike the other benchmarks this one has to commit, since the point is
+        concurrent transactions; the product it creates is deleted at the end.
+        """
+        dialect = db.session.get_bind().dialect.name
+        if dialect != 'postgresql':
+            print(f"⚠️  {dialect} serializa todas las escrituras: los resultados solo son representativos en Postgres")
+
+        print(f"{'shards':>7} {'threads':>8} {'checkouts':>10} {'seconds':>9} {'checkouts/s':>12} {'p95':>9}")
+        for shard_count in sorted(int(count) for count in shards.split(',')):
+            product = Product(name='Bench flash sale', slug=f'bench-flash-{uuid.uuid4().hex}', price=10,
+                              stock_quantity=checkouts, stock_shards=shard_count)
+            db.session.add(product)
+            db.session.flush()
+            distribute_stock(product.id, shard_count, checkouts)
+            db.session.commit()
+            product_id = product.id
+
+            remaining = [checkouts]
+            counter_lock = threading.Lock()
+            timings = []
+            errors = []
+
+            def checkout_loop():
+                with app.app_context():
+                    while True:
+                        with counter_lock:
+                            if remaining[0] <= 0:
+                                return
+                            remaining[0] -= 1
+                        started = time.perf_counter()
+                        try:
+                            taken, _ = take_sharded_stock({product_id: 1})
+                            db.session.commit()
+                            if product_id not in taken:
+                                errors.append('sin stock')
+                        except Exception as e:
+                            db.session.rollback()
+                            errors.append(str(e))
+                        timings.append((time.perf_counter() - started) * 1000)
+
+            workers = [threading.Thread(target=checkout_loop) for _ in range(threads)]
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+            timings.sort()
+            p95 = timings[int(len(timings) * 0.95) - 1] if timings else 0
+            print(f"{shard_count:>7} {threads:>8} {checkouts:>10} {elapsed:>9.2f} {checkouts / elapsed:>12.0f} {p95:>7.2f}ms")
+            if errors:
+                print(f"    ❌ {len(errors)} checkouts fallidos, p. ej.: {errors[0]}")
+
+            distribute_stock(product_id, 0, 0)
+            Product.query.filter_by(id=product_id).delete()
+            db.session.commit()
+
+    @app.cli.command('bench-filters')
+    @click.option('--sizes', default='10000,100000,1000000', help='Tamaños de catálogo separados por comas')
+    @click.option('--runs', default=20, help='Repeticiones por consulta')
+    def bench_filters(sizes, runs):
+        """Time each tag/price/sort combination and show which index serves it."""
+        sizes = sorted(int(size) for size in sizes.split(','))
+        dialect = db.session.get_bind().dialect.name
+        active = Product.query.filter_by(is_active=True)
+        price_asc = (Product.price.asc(), Product.id.asc())
+        price_desc = (Product.price.desc(), Product.id.desc())
+        newest = (Product.created_at.desc(), Product.id.desc())
+        combinations = [
+            ('newest', lambda: active.order_by(*newest)),
+            ('price_asc', lambda: active.order_by(*price_asc)),
+            ('price_desc', lambda: active.order_by(*price_desc)),
+            ('min/max price', lambda: active.filter(Product.price >= 25, Product.price <= 100).order_by(*price_asc)),
+            ('min price, newest', lambda: active.filter(Product.price >= 400).order_by(*newest)),
+        ]
+        if dialect == 'postgresql':
+            combinations += [
+                ('tags any', lambda: active.filter(Product.tags.overlap(['plata', 'oro'])).order_by(*newest)),
+                ('tags all', lambda: active.filter(Product.tags.contains(['plata', 'oro'])).order_by(*newest)),
+                ('tags all + price', lambda: active.filter(
+                    Product.tags.contains(['plata', 'oro']), Product.price <= 100).order_by(*price_asc)),
+            ]
+        seeded = 0
+
+        print(f"Dialect: {dialect}")
+        print(f"{'products':>10} {'combination':>18} {'p50':>9} {'p95':>9}  plan")
+        try:
+            for size in sizes:
+                seed_products(seeded, size - seeded)
+                seeded = size
+                if dialect == 'postgresql':
+                    db.session.execute(db.text('ANALYZE products'))
+
+                for label, build_query in combinations:
+                    p50, p95 = time_query(build_query, runs)
+                    plan = explain(build_query().limit(12))
+                    indexes = sorted(set(re.findall(r'ix_products_\w+', plan))) or ['sin índice']
+                    print(f"{size:>10} {label:>18} {p50:>7.2f}ms {p95:>7.2f}ms  {', '.join(indexes)}")
+        finally:
+            db.session.rollback()
+
+    @app.cli.command('bench-search')
+    @click.option('--sizes', default='10000,100000,1000000', help='Tamaños de catálogo separados por comas')
+    @click.option('--runs', default=20, help='Repeticiones por consulta')
+    def bench_search(sizes, runs):
+        """Compare ILIKE search latency against the full-text index."""
+        sizes = sorted(int(size) for size in sizes.split(','))
+        dialect = db.session.get_bind().dialect.name
+        seeded = 0
+
+        def ilike(term):
+            return Product.query.filter_by(is_active=True).filter(or_(
+                Product.name.ilike(f'%{term}%'),
+                Product.description.ilike(f'%{term}%')
+            )).order_by(Product.created_at.desc())
+
+        def full_text(term):
+            query, rank_order = apply_search(Product.query.filter_by(is_active=True), term)
+            return query.order_by(rank_order, Product.created_at.desc()) if rank_order is not None else query
+
+        print(f"Dialect: {dialect}")
+        print(f"{'products':>10} {'term':>10} {'ilike p50':>11} {'ilike p95':>11} {'fts p50':>9} {'fts p95':>9}")
+        try:
+            for size in sizes:
+                seed_products(seeded, size - seeded)
+                seeded = size
+                rebuild_search_index(db.session.connection())
+                if dialect == 'postgresql':
+                    db.session.execute(db.text('ANALYZE products'))
+
+                for term in ('plata', RARE_WORD):
+                    ilike_p50, ilike_p95 = time_query(lambda: ilike(term), runs)
+                    fts_p50, fts_p95 = time_query(lambda: full_text(term), runs)
+                    print(f"{size:>10} {term:>10} {ilike_p50:>9.2f}ms {ilike_p95:>9.2f}ms {fts_p50:>7.2f}ms {fts_p95:>7.2f}ms")
+        finally:
+            db.session.rollback()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, request
+
+
+def _next_second():
+    # HTTP dates have no fraction, so a version is rounded up: a change later in
+    # the same second must not compare equal to the previous Last-Modified.
+    return datetime.utcnow().replace(microsecond=0) + timedelta(seconds=1)
+
+
+def _naive_utc(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class CatalogCache:
+    """LRU cache with TTL for serialized catalog data, local to each worker.
+
+    Keys are tuples whose first element is a namespace ('product', 'products', ...)
+    so a whole namespace can be dropped at once when the catalog changes. The time
+    of the last invalidation of each namespace is kept as its version.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._changed_at = {}
+        self._cleared_at = _next_second()
+
+    def changed_at(self, namespace):
+        """When `namespace` was last invalidated, or the cache cleared, in this worker."""
+        with self._lock:
+            return max(self._cleared_at, self._changed_at.get(namespace, self._cleared_at))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate_prefix(self, *prefix):
+        with self._lock:
+            self._changed_at[prefix[0]] = _next_second()
+            for key in [key for key in self._entries if key[:len(prefix)] == prefix]:
+                del self._entries[key]
+
+    def invalidate_namespace(self, *namespaces):
+        with self._lock:
+            now = _next_second()
+            for namespace in namespaces:
+                self._changed_at[namespace] = now
+            for key in [key for key in self._entries if key[0] in namespaces]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._changed_at.clear()
+            self._cleared_at = _next_second()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+
+catalog_cache = CatalogCache(
+    max_entries=int(os.getenv('CATALOG_CACHE_SIZE', 1024)),
+    ttl=int(os.getenv('CATALOG_CACHE_TTL', 300))
+)
+
+
+CATALOG_MAX_AGE = int(os.getenv('CATALOG_MAX_AGE', 0))
+
+
+def cached_response(cache_key, load):
+    """Serve a catalog payload from the cache with a strong ETag.
+
+    `load` returns (payload, last_modified) and only runs on a cache miss. The body
+    is encoded once and stored together with its hash, so a matching If-None-Match
+    is answered with 304 without querying or serializing anything. Last-Modified is
+    never older than the last invalidation of the key's namespace, so a page that
+    lost an item, or has none, still changes it.
+    """
+    entry = catalog_cache.get(cache_key)
+    if entry is None:
+        # Read before loading: an invalidation during the query must not be covered
+        version = catalog_cache.changed_at(cache_key[0])
+        payload, last_modified = load()
+        last_modified = max(filter(None, (_naive_utc(last_modified), version)))
+        body = current_app.json.dumps(payload).encode('utf-8')
+        entry = (body, hashlib.sha256(body).hexdigest(), last_modified)
+        catalog_cache.set(cache_key, entry)
+
+    body, etag, last_modified = entry
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = CATALOG_MAX_AGE
+    response.cache_control.must_revalidate = True
+    return response.make_conditional(request)
@@ -0,0 +1,88 @@
+import uuid
+
+from sqlalchemy import case, cast, func, literal, select, union_all
+
+from api.models import db, Product
+from api.utils import APIException
+
+FACETS = ('category', 'price', 'featured')
+PRICE_BUCKETS = [0, 25, 50, 100, 250, 500]
+
+
+def parse_facets(args):
+    facets = args.get('facets')
+    if not facets:
+        return None
+
+    facets = sorted({facet.strip() for facet in facets.split(',') if facet.strip()})
+    unknown = [facet for facet in facets if facet not in FACETS]
+    if unknown:
+        raise APIException(f"Facetas desconocidas: {', '.join(unknown)}", status_code=400)
+    return facets
+
+
+def _price_bucket():
+    return case(
+        *[(Product.price < upper, index) for index, upper in enumerate(PRICE_BUCKETS[1:])],
+        else_=len(PRICE_BUCKETS) - 1
+    )
+
+
+def _price_range(bucket):
+    upper = PRICE_BUCKETS[bucket + 1] if bucket + 1 < len(PRICE_BUCKETS) else None
+    return PRICE_BUCKETS[bucket], upper
+
+
+def compute_facets(query, facets):
+    """Count the products matched by `query` per facet in a single statement.
+
+    Postgres groups once with GROUPING SETS; other databases get one GROUP BY
+    per facet glued together with UNION ALL, which is still one round trip.
+    """
+    base = query.order_by(None).with_entities(
+        Product.category_id.label('category'),
+        _price_bucket().label('price'),
+        Product.is_featured.label('featured')
+    ).subquery()
+    columns = {facet: base.c[facet] for facet in facets}
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        statement = select(
+            *columns.values(),
+            *[func.grouping(column).label(f'grouping_{facet}') for facet, column in columns.items()],
+            func.count().label('count')
+        ).group_by(func.grouping_sets(*columns.values()))
+        rows = []
+        for row in db.session.execute(statement).mappings():
+            facet = next(facet for facet in facets if row[f'grouping_{facet}'] == 0)
+            rows.append((facet, row[facet], row['count']))
+    else:
+        statement = union_all(*[
+            select(literal(facet).label('facet'), cast(column, db.String).label('value'), func.count().label('count'))
+            .group_by(column)
+            for facet, column in columns.items()
+        ])
+        rows = [(facet, _parse_value(facet, value), count) for facet, value, count in db.session.execute(statement)]
+
+    result = {facet: [] for facet in facets}
+    for facet, value, count in rows:
+        if facet == 'price':
+            minimum, maximum = _price_range(int(value))
+            result[facet].append({"min": minimum, "max": maximum, "count": count})
+        elif facet == 'category':
+            result[facet].append({"value": str(value) if value else None, "count": count})
+        else:
+            result[facet].append({"value": bool(value), "count": count})
+
+    for facet, buckets in result.items():
+        key = (lambda bucket: bucket['min']) if facet == 'price' else (lambda bucket: -bucket['count'])
+        buckets.sort(key=key)
+    return result
+
+
+def _parse_value(facet, value):
+    if value is None:
+        return None
+    if facet == 'category':
+        return uuid.UUID(value)
+    return int(value)
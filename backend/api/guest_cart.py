@@ -0,0 +1,66 @@
+"""
+Anonymous carts live in the client as a signed token, so browsing without an
+account never writes cart rows. The token travels in the guest_cart cookie, or in
+the X-Guest-Cart header for frontends served from another origin, and holds only
+(product, variant, quantity) triples: prices and stock are read from the catalog
+every time the cart is shown.
+"""
+
+import uuid
+from datetime import timedelta
+
+from flask import current_app, request
+from itsdangerous import BadSignature, URLSafeSerializer
+
+GUEST_CART_COOKIE = 'guest_cart'
+GUEST_CART_HEADER = 'X-Guest-Cart'
+GUEST_CART_MAX_AGE = timedelta(days=30)
+MAX_GUEST_CART_LINES = 40
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['JWT_SECRET_KEY'], salt='guest-cart')
+
+
+def dump_guest_cart(lines):
+    if not lines:
+        return None
+    return _serializer().dumps([
+        [product_id.hex, variant_id.hex if variant_id else '', quantity]
+        for (product_id, variant_id), quantity in lines.items()
+    ])
+
+
+def read_guest_cart():
+    """Lines of the request's guest cart as {(product_id, variant_id): quantity}.
+
+    A missing, tampered or malformed token is treated as an empty cart.
+    """
+    token = request.headers.get(GUEST_CART_HEADER) or request.cookies.get(GUEST_CART_COOKIE)
+    if not token:
+        return {}
+
+    try:
+        lines = {}
+        for product_id, variant_id, quantity in _serializer().loads(token)[:MAX_GUEST_CART_LINES]:
+            if isinstance(quantity, int) and quantity > 0:
+                key = (uuid.UUID(product_id), uuid.UUID(variant_id) if variant_id else None)
+                lines[key] = quantity
+        return lines
+    except (BadSignature, TypeError, ValueError):
+        return {}
+
+
+def save_guest_cart(response, token):
+    if not token:
+        clear_guest_cart(response)
+        return
+    response.set_cookie(
+        GUEST_CART_COOKIE, token,
+        max_age=int(GUEST_CART_MAX_AGE.total_seconds()),
+        httponly=True, samesite='Lax', secure=request.is_secure
+    )
+
+
+def clear_guest_cart(response):
+    response.delete_cookie(GUEST_CART_COOKIE, httponly=True, samesite='Lax', secure=request.is_secure)
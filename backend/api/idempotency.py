@@ -0,0 +1,160 @@
+"""
+Idempotency-Key support for endpoints that must not run twice, like checkout.
+
+The first request with a key claims a row in its own committed transaction, then
+runs the view and stores the response. A retry with the same key replays that
+response. A duplicate that arrives while the first one is still running waits
+for it, up to IDEMPOTENCY_WAIT seconds. Server errors release the claim, so the
+client can retry them. A claim whose request died is taken over after
+IDEMPOTENCY_LOCK_TIMEOUT.
+"""
+
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+import click
+from flask import current_app, request
+from flask_jwt_extended import get_current_user
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api.models import db, IdempotencyKey
+from api.utils import APIException
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_TTL = timedelta(hours=int(os.getenv('IDEMPOTENCY_TTL_HOURS', 24)))
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', 10))
+IDEMPOTENCY_LOCK_TIMEOUT = timedelta(seconds=60)
+POLL_INTERVAL = 0.1
+
+
+def _request_hash():
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {request.path}\n'.encode('utf-8'))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def _claim(user_id, key, request_hash):
+    """Insert or take over the key's row; True when this request now owns it."""
+    now = datetime.utcnow()
+    keys = IdempotencyKey.__table__
+    db.session.execute(delete(keys).where(keys.c.user_id == user_id, keys.c.expires_at < now))
+
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    claimed = db.session.execute(
+        insert(keys).values(
+            user_id=user_id, key=key, request_hash=request_hash, status='processing',
+            locked_at=now, expires_at=now + IDEMPOTENCY_TTL, created_at=now
+        ).on_conflict_do_nothing(index_elements=['user_id', 'key']).returning(keys.c.id)
+    ).first()
+    if claimed is None:
+        claimed = db.session.execute(
+            update(keys)
+            .where(
+                keys.c.user_id == user_id, keys.c.key == key, keys.c.request_hash == request_hash,
+                keys.c.status == 'processing', keys.c.locked_at < now - IDEMPOTENCY_LOCK_TIMEOUT
+            )
+            .values(locked_at=now)
+            .returning(keys.c.id)
+        ).first()
+    db.session.commit()
+    return claimed is not None
+
+
+def _store(user_id, key, status, body):
+    keys = IdempotencyKey.__table__
+    db.session.execute(
+        update(keys)
+        .where(keys.c.user_id == user_id, keys.c.key == key)
+        .values(status='completed', response_status=status, response_body=body)
+    )
+    db.session.commit()
+
+
+def _release(user_id, key):
+    keys = IdempotencyKey.__table__
+    db.session.execute(delete(keys).where(keys.c.user_id == user_id, keys.c.key == key, keys.c.status == 'processing'))
+    db.session.commit()
+
+
+def _replay(row):
+    response = current_app.response_class(row.response_body, status=row.response_status, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(view):
+    """Make a @jwt_required view safe to retry with an Idempotency-Key header."""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            raise APIException("Idempotency-Key demasiado larga", status_code=400)
+
+        user_id = get_current_user().id
+        request_hash = _request_hash()
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+
+        while not _claim(user_id, key, request_hash):
+            row = db.session.execute(
+                select(IdempotencyKey.__table__).where(
+                    IdempotencyKey.user_id == user_id, IdempotencyKey.key == key)
+            ).first()
+            db.session.rollback()
+            if row is not None and row.request_hash != request_hash:
+                raise APIException("Idempotency-Key ya usada con otra petición", status_code=422)
+            if row is not None and row.status == 'completed':
+                return _replay(row)
+            if time.monotonic() > deadline:
+                raise APIException("La petición original sigue en curso", status_code=409)
+            if row is not None:
+                time.sleep(POLL_INTERVAL)
+
+        try:
+            response = current_app.make_response(view(*args, **kwargs))
+        except APIException as e:
+            if e.status_code < 500:
+                _store(user_id, key, e.status_code, current_app.json.dumps(e.to_dict()))
+            else:
+                _release(user_id, key)
+            raise
+        except Exception:
+            db.session.rollback()
+            _release(user_id, key)
+            raise
+
+        if response.status_code < 500:
+            _store(user_id, key, response.status_code, response.get_data(as_text=True))
+        else:
+            _release(user_id, key)
+        return response
+
+    return wrapper
+
+
+def purge_expired(batch_size=1000):
+    keys = IdempotencyKey.__table__
+    purged = 0
+    while True:
+        expired = select(keys.c.id).where(keys.c.expires_at < datetime.utcnow()).limit(batch_size).scalar_subquery()
+        count = db.session.execute(delete(keys).where(keys.c.id.in_(expired))).rowcount
+        db.session.commit()
+        purged += count
+        if count < batch_size:
+            return purged
+
+
+def setup_idempotency(app):
+
+    @app.cli.command('purge-idempotency-keys')
+    @click.option('--batch-size', default=1000, help='Claves borradas por transacción')
+    def purge_idempotency_keys(batch_size):
+        """Delete expired idempotency keys."""
+        print(f"🧹 Claves de idempotencia borradas: {purge_expired(batch_size)}")
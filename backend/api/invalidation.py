@@ -0,0 +1,206 @@
+"""
+Cache invalidation bus shared by every worker.
+
+Writers call publish() before committing. On Postgres the keys travel with a
+NOTIFY that is only delivered if the transaction commits; on other databases they
+are written to the cache_invalidations table and picked up by polling. Either way
+the local cache is evicted right after the commit, and a listener thread in each
+worker evicts the same keys when the message arrives.
+
+Keys are 'namespace:id' for a single entry or just 'namespace' to drop every entry
+of that namespace (e.g. 'product:<uuid>', 'products'). A write touching more than
+MAX_KEYS_PER_NAMESPACE ids of one namespace publishes the namespace instead, and
+long messages are split so each NOTIFY stays under the payload limit.
+"""
+
+import os
+import select
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+from api.models import db, CacheInvalidation
+from api.cache import catalog_cache
+
+CHANNEL = 'cache_invalidation'
+POLL_INTERVAL = float(os.getenv('CACHE_POLL_INTERVAL', 2))
+RETENTION = timedelta(minutes=10)
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7500
+MAX_KEYS_PER_NAMESPACE = 50
+
+_listener = None
+_listener_lock = threading.Lock()
+_subscribers = []
+
+
+def _collapse(keys):
+    """Replace the ids of a namespace with the namespace key once there are too many."""
+    by_namespace = {}
+    for key in keys:
+        namespace, _, ident = key.partition(':')
+        by_namespace.setdefault(namespace, set()).add(ident)
+    collapsed = set()
+    for namespace, idents in by_namespace.items():
+        if '' in idents or len(idents) > MAX_KEYS_PER_NAMESPACE:
+            collapsed.add(namespace)
+        else:
+            collapsed.update(f'{namespace}:{ident}' for ident in idents)
+    return collapsed
+
+
+def _payloads(keys):
+    """Comma-joined keys split into chunks that fit in one NOTIFY."""
+    chunk, size = [], 0
+    for key in sorted(keys):
+        if chunk and size + len(key) + 1 > MAX_PAYLOAD_BYTES:
+            yield ','.join(chunk)
+            chunk, size = [], 0
+        chunk.append(key)
+        size += len(key) + 1
+    if chunk:
+        yield ','.join(chunk)
+
+
+def publish(*keys):
+    if not keys:
+        return
+    keys = _collapse(keys)
+    db.session.info.setdefault('invalidation_keys', set()).update(keys)
+    postgres = db.session.get_bind().dialect.name == 'postgresql'
+    for payload in _payloads(keys):
+        if postgres:
+            db.session.execute(db.select(func.pg_notify(CHANNEL, payload)))
+        else:
+            db.session.add(CacheInvalidation(keys=payload))
+
+
+def product_changed(product_id=None):
+    if product_id is None:
+        publish('products')
+    else:
+        publish(f'product:{product_id}', 'products')
+
+
+def subscribe(callback):
+    """Register callback(namespace, ident) for every invalidated key.
+
+    ident is None for namespace-wide keys, and both are None when everything must
+    be considered stale. Callbacks run on the listener thread and must not block.
+    """
+    _subscribers.append(callback)
+    return callback
+
+
+def apply_invalidation(keys):
+    for key in keys:
+        namespace, _, ident = key.partition(':')
+        if ident:
+            catalog_cache.invalidate_prefix(namespace, ident)
+        else:
+            catalog_cache.invalidate_namespace(namespace)
+        for callback in _subscribers:
+            callback(namespace, ident or None)
+
+
+def invalidate_everything():
+    catalog_cache.clear()
+    for callback in _subscribers:
+        callback(None, None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_after_commit(session):
+    keys = session.info.pop('invalidation_keys', None)
+    if keys:
+        apply_invalidation(keys)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _discard_after_rollback(session, previous_transaction):
+    session.info.pop('invalidation_keys', None)
+
+
+class InvalidationListener(threading.Thread):
+
+    def __init__(self, app, mode):
+        super().__init__(name='cache-invalidation', daemon=True)
+        self.app = app
+        self.mode = mode
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.mode == 'notify':
+                    self._listen()
+                else:
+                    self._poll()
+            except Exception as e:
+                print(f"❌ Error en el bus de invalidación: {str(e)}")
+                self._stopped.wait(POLL_INTERVAL)
+
+    def _listen(self):
+        with self.app.app_context():
+            connection = db.engine.raw_connection()
+        try:
+            dbapi_connection = connection.driver_connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f'LISTEN {CHANNEL}')
+            # Anything published while we were not listening is lost.
+            invalidate_everything()
+            while not self._stopped.is_set():
+                if select.select([dbapi_connection], [], [], POLL_INTERVAL) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    notify = dbapi_connection.notifies.pop(0)
+                    apply_invalidation(notify.payload.split(','))
+        finally:
+            connection.invalidate()
+
+    def _poll(self):
+        with self.app.app_context():
+            last_id = db.session.query(func.max(CacheInvalidation.id)).scalar() or 0
+        invalidate_everything()
+        last_cleanup = time.monotonic()
+        while not self._stopped.wait(POLL_INTERVAL):
+            with self.app.app_context():
+                rows = CacheInvalidation.query.filter(CacheInvalidation.id > last_id).order_by(CacheInvalidation.id).all()
+                for row in rows:
+                    apply_invalidation(row.keys.split(','))
+                    last_id = row.id
+                if time.monotonic() - last_cleanup > RETENTION.total_seconds():
+                    CacheInvalidation.query.filter(CacheInvalidation.created_at < datetime.utcnow() - RETENTION).delete()
+                    db.session.commit()
+                    last_cleanup = time.monotonic()
+
+
+def start_listener(app):
+    global _listener
+    with _listener_lock:
+        if _listener is not None and _listener.is_alive():
+            return _listener
+        mode = os.getenv('CACHE_INVALIDATION_MODE')
+        if not mode:
+            with app.app_context():
+                mode = 'notify' if db.engine.dialect.name == 'postgresql' else 'poll'
+        if mode == 'off':
+            return None
+        _listener = InvalidationListener(app, mode)
+        _listener.start()
+        return _listener
+
+
+def setup_invalidation(app):
+    # Started on the first request so each gunicorn worker gets its own listener.
+    @app.before_request
+    def _ensure_listener():
+        if _listener is None or not _listener.is_alive():
+            start_listener(app)
@@ -0,0 +1,409 @@
+"""
+Every write to product stock goes through update_stock(), which locks the rows
+in id order and applies all changes with one conditional UPDATE.
+
+Stock reservations hold the quantities of a cart between create-payment-intent
+and confirm-payment, so a customer who has started paying cannot be outsold.
+
+Each hold is a stock_reservations row with an expiry, mirrored in the
+products.reserved_quantity counter so availability is stock_quantity -
+reserved_quantity on the product row itself, with no aggregate over the holds.
+Counters are only ever changed together with the rows that back them: when
+reserving, when the checkout consumes the holds, and when the sweeper releases
+expired ones.
+
+Flash-sale products can be switched to sharded stock ('flask shard-stock'): their
+units are split across product_stock_shards rows so concurrent checkouts update
+different rows instead of queueing on the product. They are never held, and
+their availability is the sum of the shards.
+"""
+
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, bindparam, case, delete, func, insert, literal, or_, select, update
+
+from api.models import db, Product, ProductStockShard, StockReservation
+from api.invalidation import publish
+
+RESERVATION_TTL = timedelta(seconds=int(os.getenv('STOCK_RESERVATION_TTL', 900)))
+SWEEP_INTERVAL = float(os.getenv('RESERVATION_SWEEP_INTERVAL', 60))
+SWEEP_BATCH_SIZE = 500
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def _sum_by_product(rows):
+    quantities = {}
+    for product_id, quantity in rows:
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+def lock_products(product_ids):
+    """Lock product rows in id order and return {id: (stock, reserved)}.
+
+    Every writer of stock or reserved_quantity locks through here first, so two
+    transactions touching the same products always queue in the same order.
+    """
+    products = Product.__table__
+    rows = db.session.execute(
+        select(products.c.id, products.c.stock_quantity, products.c.reserved_quantity)
+        .where(products.c.id.in_(product_ids))
+        .order_by(products.c.id)
+        .with_for_update()
+    )
+    return {row.id: (row.stock_quantity, row.reserved_quantity) for row in rows}
+
+
+def _available(locked):
+    return {product_id: max(stock - reserved, 0) for product_id, (stock, reserved) in locked.items()}
+
+
+def _short_lines(cart_items, needed, done, available):
+    return [
+        {
+            "item_id": str(item.id),
+            "product_id": str(item.product_id),
+            "name": item.product.name,
+            "quantity": item.quantity,
+            "requested": needed[item.product_id],
+            "available": available.get(item.product_id, 0)
+        }
+        for item in cart_items if item.product_id in needed and item.product_id not in done
+    ]
+
+
+def update_stock(taken=None, reserved=None):
+    """Apply stock and hold changes to many products with one UPDATE.
+
+    `taken` maps product ids to units leaving stock, `reserved` to the change in
+    their held units (negative to release). A product is only updated when its
+    available stock stays non-negative, except pure releases, which always apply.
+    Returns the updated ids and the (stock, reserved) locked before the change.
+    """
+    taken = taken or {}
+    reserved = reserved or {}
+    product_ids = sorted(set(taken) | set(reserved))
+    if not product_ids:
+        return set(), {}
+    locked = lock_products(product_ids)
+
+    products = Product.__table__
+    taken_units = case(taken, value=products.c.id, else_=0) if taken else literal(0)
+    held_units = case(reserved, value=products.c.id, else_=0) if reserved else literal(0)
+    new_stock = products.c.stock_quantity - taken_units
+    new_reserved = products.c.reserved_quantity + held_units
+    updated = set(db.session.execute(
+        update(products)
+        .where(
+            products.c.id.in_(product_ids),
+            or_(new_stock - new_reserved >= 0, and_(taken_units == 0, held_units <= 0))
+        )
+        .values(stock_quantity=new_stock, reserved_quantity=new_reserved)
+        .returning(products.c.id)
+    ).scalars())
+
+    if updated:
+        # Listing pages show stock too; publish() collapses long id lists to 'product'
+        publish('products', *[f'product:{product_id}' for product_id in sorted(updated)])
+    return updated, locked
+
+
+def available_to(user_id):
+    """Product.available_quantity plus the units the user holds: those are theirs to buy."""
+    held = (
+        select(func.coalesce(func.sum(StockReservation.quantity), 0))
+        .where(StockReservation.user_id == user_id, StockReservation.product_id == Product.id)
+        .correlate(Product)
+        .scalar_subquery()
+    )
+    return Product.available_quantity + held
+
+
+def _delete_reservations(condition):
+    return db.session.execute(
+        delete(StockReservation)
+        .where(condition)
+        .returning(StockReservation.product_id, StockReservation.quantity)
+    ).all()
+
+
+def release_reservations(user_id):
+    released = _sum_by_product(_delete_reservations(StockReservation.user_id == user_id))
+    update_stock(reserved={product_id: -quantity for product_id, quantity in released.items()})
+
+
+def reserve_stock(user_id, cart_items, ttl=RESERVATION_TTL):
+    """Hold the cart's quantities for `ttl`, replacing any earlier holds of the user.
+
+    Returns the cart lines that cannot be covered by the available stock; the
+    caller rolls back in that case. The caller commits.
+    """
+    # Sharded products are not held: their point is to never touch the product row.
+    needed = _sum_by_product((item.product_id, item.quantity) for item in cart_items if not item.product.stock_shards)
+    released = _sum_by_product(_delete_reservations(StockReservation.user_id == user_id))
+    changes = {product_id: needed.get(product_id, 0) - released.get(product_id, 0)
+               for product_id in set(needed) | set(released)}
+    updated, locked = update_stock(reserved=changes)
+
+    if not set(needed) <= updated:
+        return _short_lines(cart_items, needed, updated, _available(locked))
+
+    now = datetime.utcnow()
+    db.session.execute(insert(StockReservation.__table__), [
+        {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "expires_at": now + ttl,
+            "created_at": now
+        }
+        for product_id, quantity in needed.items()
+    ])
+    return []
+
+
+def take_stock(user_id, cart_items):
+    """Turn the user's holds into sold stock for the cart.
+
+    Units the user still holds count as available to them; lines without a hold
+    (it expired, or the cart grew) need free stock. Regular products are settled
+    with one UPDATE, sharded ones through their shards. Returns the short cart
+    lines; the caller rolls back in that case.
+    """
+    needed = _sum_by_product((item.product_id, item.quantity) for item in cart_items if not item.product.stock_shards)
+    sharded = _sum_by_product((item.product_id, item.quantity) for item in cart_items if item.product.stock_shards)
+    released = _sum_by_product(_delete_reservations(StockReservation.user_id == user_id))
+    updated, locked = update_stock(
+        taken=needed,
+        reserved={product_id: -quantity for product_id, quantity in released.items()}
+    )
+    # Always after the product rows, so every checkout takes its locks in the same order.
+    taken, shard_totals = take_sharded_stock(sharded)
+
+    short = _short_lines(cart_items, needed, updated, _available(locked))
+    return short + _short_lines(cart_items, sharded, taken, shard_totals)
+
+
+def take_sharded_stock(needed):
+    """Take stock of sharded products, returning the ids taken and the totals seen.
+
+    Each product first tries one UPDATE on a random shard that covers the whole
+    quantity, skipping shards other checkouts have locked, so concurrent buyers
+    spread over the shards instead of queueing on one row. Only when no single
+    free shard is enough are all of its shards locked and drained in order.
+    """
+    shards = ProductStockShard.__table__
+    taken = set()
+    totals = {}
+    for product_id in sorted(needed):
+        quantity = needed[product_id]
+        pick = (
+            select(shards.c.shard)
+            .where(shards.c.product_id == product_id, shards.c.quantity >= quantity)
+            .order_by(func.random())
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        row = db.session.execute(
+            update(shards)
+            .where(shards.c.product_id == product_id, shards.c.shard == pick, shards.c.quantity >= quantity)
+            .values(quantity=shards.c.quantity - quantity)
+            .returning(shards.c.shard)
+        ).first()
+        if row is not None:
+            taken.add(product_id)
+            continue
+
+        rows = db.session.execute(
+            select(shards.c.shard, shards.c.quantity)
+            .where(shards.c.product_id == product_id)
+            .order_by(shards.c.shard)
+            .with_for_update()
+        ).all()
+        totals[product_id] = sum(row.quantity for row in rows)
+        if totals[product_id] < quantity:
+            continue
+
+        remaining = quantity
+        changes = []
+        for shard, available in rows:
+            used = min(available, remaining)
+            if used:
+                changes.append({"b_product_id": product_id, "b_shard": shard, "b_quantity": available - used})
+                remaining -= used
+        db.session.execute(
+            update(shards)
+            .where(shards.c.product_id == bindparam('b_product_id'), shards.c.shard == bindparam('b_shard'))
+            .values(quantity=bindparam('b_quantity')),
+            changes
+        )
+        taken.add(product_id)
+    if taken:
+        publish('products', *[f'product:{product_id}' for product_id in sorted(taken)])
+    return taken, totals
+
+
+def distribute_stock(product_id, shard_count, total):
+    """Replace a product's shards with `shard_count` rows sharing `total` units."""
+    shards = ProductStockShard.__table__
+    db.session.execute(delete(shards).where(shards.c.product_id == product_id))
+    if shard_count > 0:
+        db.session.execute(insert(shards), [
+            {"product_id": product_id, "shard": shard,
+             "quantity": total // shard_count + (1 if shard < total % shard_count else 0)}
+            for shard in range(shard_count)
+        ])
+
+
+def set_stock_shards(product, shard_count):
+    """Switch a product between one stock row and `shard_count` shards.
+
+    Holds live on the product row, so a product with active reservations cannot
+    be switched until they are consumed or expire.
+    """
+    stock, reserved = lock_products([product.id])[product.id]
+    if reserved:
+        raise ValueError(f"{product.name} tiene {reserved} unidades reservadas")
+
+    shards = ProductStockShard.__table__
+    if product.stock_shards:
+        total = db.session.execute(
+            select(func.coalesce(func.sum(shards.c.quantity), 0)).where(shards.c.product_id == product.id)
+        ).scalar()
+    else:
+        total = stock
+
+    distribute_stock(product.id, shard_count, total)
+    product.stock_shards = shard_count
+    product.stock_quantity = total
+    publish(f'product:{product.id}', 'products')
+    return total
+
+
+def set_stock(product, quantity):
+    """Set a product's stock to `quantity` units, as an admin edit does.
+
+    A product with one stock row goes through update_stock(), so the edit cannot
+    leave fewer units than are held; a sharded one has its shards redistributed,
+    since those are what checkouts take from.
+    """
+    stock, reserved = lock_products([product.id])[product.id]
+    if product.stock_shards:
+        distribute_stock(product.id, product.stock_shards, quantity)
+        db.session.execute(
+            update(Product.__table__).where(Product.__table__.c.id == product.id).values(stock_quantity=quantity)
+        )
+        publish(f'product:{product.id}', 'products')
+    else:
+        updated, _ = update_stock(taken={product.id: stock - quantity})
+        if product.id not in updated:
+            raise ValueError(f"{product.name} tiene {reserved} unidades reservadas")
+    db.session.expire(product, ['stock_quantity', 'available_quantity'])
+
+
+def sweep_expired(batch_size=SWEEP_BATCH_SIZE):
+    """Release one batch of expired holds and return how many rows were released.
+
+    SKIP LOCKED lets every worker sweep at the same time without waiting on the
+    rows a checkout is consuming right now.
+    """
+    expired = (
+        select(StockReservation.id)
+        .where(StockReservation.expires_at < datetime.utcnow())
+        .order_by(StockReservation.expires_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    rows = _delete_reservations(StockReservation.id.in_(expired))
+    released = _sum_by_product(rows)
+    update_stock(reserved={product_id: -quantity for product_id, quantity in released.items()})
+    return len(rows)
+
+
+def sweep_all_expired(batch_size=SWEEP_BATCH_SIZE):
+    released = 0
+    while True:
+        count = sweep_expired(batch_size)
+        db.session.commit()
+        released += count
+        if count < batch_size:
+            return released
+
+
+class ReservationSweeper(threading.Thread):
+
+    def __init__(self, app, interval):
+        super().__init__(name='reservation-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    released = sweep_all_expired()
+                    if released:
+                        print(f"🧹 Reservas de stock liberadas: {released}")
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"❌ Error liberando reservas de stock: {str(e)}")
+
+
+def start_sweeper(app):
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is None or not _sweeper.is_alive():
+            _sweeper = ReservationSweeper(app, SWEEP_INTERVAL)
+            _sweeper.start()
+        return _sweeper
+
+
+def _as_uuid(value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        return None
+
+
+def setup_inventory(app):
+
+    # Started on the first request so each gunicorn worker gets its own sweeper.
+    @app.before_request
+    def _ensure_sweeper():
+        if SWEEP_INTERVAL > 0 and (_sweeper is None or not _sweeper.is_alive()):
+            start_sweeper(app)
+
+    @app.cli.command('shard-stock')
+    @click.argument('product')
+    @click.option('--shards', default=8, help='Número de filas de stock (0 vuelve a una sola fila)')
+    def shard_stock(product, shards):
+        """Split a product's stock across SHARDS counter rows for flash sales."""
+        target = Product.query.filter(or_(Product.slug == product, Product.id == _as_uuid(product))).first()
+        if target is None:
+            raise click.ClickException(f"Producto no encontrado: {product}")
+        try:
+            total = set_stock_shards(target, shards)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+        print(f"✅ {target.name}: {total} unidades en {shards or 1} fila(s)")
+
+    @app.cli.command('sweep-reservations')
+    @click.option('--batch-size', default=SWEEP_BATCH_SIZE, help='Reservas liberadas por transacción')
+    def sweep_reservations(batch_size):
+        """Release expired stock reservations."""
+        print(f"🧹 Reservas de stock liberadas: {sweep_all_expired(batch_size)}")
@@ -1,6 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from sqlalchemy.dialects.postgresql import UUID, JSONB
+from sqlalchemy import case, event, inspect, literal, or_, select, func
+from sqlalchemy.dialects.postgresql import UUID, JSONB, TSVECTOR, ARRAY
+from sqlalchemy.orm import deferred
 from datetime import datetime
 import enum
 import uuid
@@ -60,6 +62,11 @@ class User(db.Model):
 
 class Category(db.Model):
     __tablename__ = 'categories'
+    __table_args__ = (
+        db.Index('ix_categories_active_sort', 'sort_order', 'name',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active = 1')),
+        db.Index('ix_categories_path', 'path', postgresql_ops={'path': 'text_pattern_ops'}),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = db.Column(db.String(100), nullable=False)
@@ -67,6 +74,9 @@ class Category(db.Model):
     description = db.Column(db.Text, nullable=True)
     image_url = db.Column(db.Text, nullable=True)
     parent_id = db.Column(UUID(as_uuid=True), db.ForeignKey('categories.id'), nullable=True)
+    # Materialized path of ids from the root, e.g. '/<root hex>/<child hex>/'.
+    # NOCASE lets SQLite serve the LIKE prefix match from the index.
+    path = db.Column(db.String(1024).with_variant(db.String(1024, collation='NOCASE'), 'sqlite'), nullable=True)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     sort_order = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
@@ -89,8 +99,74 @@ class Category(db.Model):
             "sort_order": self.sort_order
         }
 
+    def subtree_ids(self):
+        """Select of the ids of this category and all its active descendants.
+
+        The category itself is included even when inactive, as filtering by its id
+        always returned its own products.
+        """
+        if not self.path:
+            return select(Category.id).where(Category.id == self.id)
+        return select(Category.id).where(
+            Category.path.like(self.path + '%'),
+            or_(Category.id == self.id, Category.is_active.is_(True))
+        )
+
+@event.listens_for(Category, 'before_insert')
+@event.listens_for(Category, 'before_update')
+def _update_category_path(mapper, connection, target):
+    state = inspect(target)
+    if state.has_identity and target.path and not state.attrs.parent_id.history.has_changes():
+        return
+    
+    if target.id is None:
+        target.id = uuid.uuid4()
+    
+    parent_path = '/'
+    if target.parent_id:
+        parent_path = connection.scalar(select(Category.path).where(Category.id == uuid.UUID(str(target.parent_id))))
+        if parent_path is None:
+            raise ValueError("La categoría padre no tiene ruta")
+    
+    old_path = target.path
+    new_path = f"{parent_path}{target.id.hex}/"
+    if old_path and parent_path.startswith(old_path):
+        raise ValueError("Una categoría no puede ser descendiente de sí misma")
+    target.path = new_path
+    
+    if old_path and old_path != new_path:
+        categories = Category.__table__
+        connection.execute(
+            categories.update()
+            .where(categories.c.path.startswith(old_path), categories.c.id != target.id)
+            .values(path=literal(new_path) + func.substr(categories.c.path, len(old_path) + 1))
+        )
+
+class ProductStockShard(db.Model):
+    """One slice of a sharded product's stock (see api/inventory.py)."""
+    __tablename__ = 'product_stock_shards'
+    
+    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ProductStockShard {self.product_id}-{self.shard}>'
+
 class Product(db.Model):
     __tablename__ = 'products'
+    __table_args__ = (
+        db.Index('ix_products_search_vector', 'search_vector', postgresql_using='gin').ddl_if(dialect='postgresql'),
+        db.Index('ix_products_active_created', 'created_at', 'id',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active = 1')),
+        db.Index('ix_products_category_active_created', 'category_id', 'created_at', 'id',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active = 1')),
+        db.Index('ix_products_featured_created', 'created_at', 'id',
+                 postgresql_where=db.text('is_active AND is_featured'), sqlite_where=db.text('is_active = 1 AND is_featured = 1')),
+        db.Index('ix_products_active_price', 'price', 'id',
+                 postgresql_where=db.text('is_active'), sqlite_where=db.text('is_active = 1')),
+        db.Index('ix_products_tags', 'tags', postgresql_using='gin').ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     name = db.Column(db.String(255), nullable=False)
@@ -103,6 +179,10 @@ class Product(db.Model):
     cost_price = db.Column(db.Numeric(10, 2), nullable=True)
     track_inventory = db.Column(db.Boolean, nullable=False, default=True)
     stock_quantity = db.Column(db.Integer, nullable=False, default=0)
+    # Held by open checkouts (see StockReservation); available = stock - reserved.
+    reserved_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # > 0 for flash-sale products whose stock lives in that many ProductStockShard rows.
+    stock_shards = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     low_stock_threshold = db.Column(db.Integer, nullable=False, default=5)
     weight = db.Column(db.Numeric(8, 2), nullable=True)
     dimensions_length = db.Column(db.Numeric(8, 2), nullable=True)
@@ -116,7 +196,9 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, nullable=False, default=False)
     meta_title = db.Column(db.String(255), nullable=True)
     meta_description = db.Column(db.Text, nullable=True)
-    tags = db.Column(db.ARRAY(db.Text), nullable=True)
+    tags = db.Column(ARRAY(db.Text), nullable=True)
+    # Only read inside SQL by the search predicate and rank, never loaded with the row
+    search_vector = deferred(db.Column(TSVECTOR().with_variant(db.Text, 'sqlite'), nullable=True))
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
     updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -128,30 +210,56 @@ class Product(db.Model):
     def __repr__(self):
         return f'<Product {self.name}>'
 
-    def serialize(self):
-        return {
-            "id": str(self.id),
-            "name": self.name,
-            "slug": self.slug,
-            "description": self.description,
-            "short_description": self.short_description,
-            "sku": self.sku,
-            "price": float(self.price) if self.price else None,
-            "compare_price": float(self.compare_price) if self.compare_price else None,
-            "stock_quantity": self.stock_quantity,
-            "image_url": self.image_url,
-            "gallery_images": self.gallery_images,
-            "category_id": str(self.category_id) if self.category_id else None,
-            "vendor_id": str(self.vendor_id) if self.vendor_id else None,
-            "is_active": self.is_active,
-            "is_featured": self.is_featured,
-            "tags": self.tags,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None
-        }
+    SERIALIZERS = {
+        "id": lambda p: str(p.id),
+        "name": lambda p: p.name,
+        "slug": lambda p: p.slug,
+        "description": lambda p: p.description,
+        "short_description": lambda p: p.short_description,
+        "sku": lambda p: p.sku,
+        "price": lambda p: float(p.price) if p.price else None,
+        "compare_price": lambda p: float(p.compare_price) if p.compare_price else None,
+        # Checkouts of sharded products only decrement the shards
+        "stock_quantity": lambda p: p.available_quantity if p.stock_shards else p.stock_quantity,
+        "available_quantity": lambda p: max(p.available_quantity or 0, 0),
+        "image_url": lambda p: p.image_url,
+        "gallery_images": lambda p: p.gallery_images,
+        "category_id": lambda p: str(p.category_id) if p.category_id else None,
+        "vendor_id": lambda p: str(p.vendor_id) if p.vendor_id else None,
+        "is_active": lambda p: p.is_active,
+        "is_featured": lambda p: p.is_featured,
+        "tags": lambda p: p.tags,
+        "created_at": lambda p: p.created_at.isoformat() if p.created_at else None,
+        "updated_at": lambda p: p.updated_at.isoformat() if p.updated_at else None
+    }
+
+    def serialize(self, fields=None):
+        return {field: self.SERIALIZERS[field](self) for field in (fields or self.SERIALIZERS)}
+
+# Sharded products are summed from their shards; the subquery only runs for them.
+Product.available_quantity = db.column_property(
+    case(
+        (Product.stock_shards > 0, func.coalesce(
+            select(func.sum(ProductStockShard.quantity))
+            .where(ProductStockShard.product_id == Product.id)
+            .correlate_except(ProductStockShard)
+            .scalar_subquery(), 0)),
+        else_=Product.stock_quantity - Product.reserved_quantity
+    )
+)
 
 class CartItem(db.Model):
     __tablename__ = 'cart_items'
+    __table_args__ = (
+        db.Index('ix_cart_items_user_product', 'user_id', 'product_id'),
+        # One line per product and variant; NULL variants need their own partial index.
+        db.Index('uq_cart_items_user_product', 'user_id', 'product_id', unique=True,
+                 postgresql_where=db.text('product_variant_id IS NULL'),
+                 sqlite_where=db.text('product_variant_id IS NULL')),
+        db.Index('uq_cart_items_user_product_variant', 'user_id', 'product_id', 'product_variant_id', unique=True,
+                 postgresql_where=db.text('product_variant_id IS NOT NULL'),
+                 sqlite_where=db.text('product_variant_id IS NOT NULL')),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
@@ -172,6 +280,7 @@ class CartItem(db.Model):
             "product_id": str(self.product_id),
             "product_variant_id": str(self.product_variant_id) if self.product_variant_id else None,
             "product": self.product.serialize() if self.product else None,
+            "product_variant": self.product_variant.serialize() if self.product_variant else None,
             "quantity": self.quantity,
             "price": float(self.price) if self.price else None,
             "subtotal": float(self.price * self.quantity) if self.price else 0,
@@ -229,6 +338,9 @@ class PaymentStatusEnum(enum.Enum):
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('ix_orders_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -256,7 +368,7 @@ class Order(db.Model):
     def __repr__(self):
         return f'<Order {self.order_number}>'
 
-    def serialize(self):
+    def serialize(self, products=None):
         return {
             "id": str(self.id),
             "order_number": self.order_number,
@@ -274,13 +386,16 @@ class Order(db.Model):
             "billing_address": self.billing_address,
             "notes": self.notes,
             "tracking_number": self.tracking_number,
-            "order_items": [item.serialize() for item in self.order_items],
+            "order_items": [item.serialize(products) for item in self.order_items],
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None
         }
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
+    __table_args__ = (
+        db.Index('ix_order_items_order', 'order_id'),
+    )
     
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     order_id = db.Column(UUID(as_uuid=True), db.ForeignKey('orders.id'), nullable=False)
@@ -295,15 +410,96 @@ class OrderItem(db.Model):
     def __repr__(self):
         return f'<OrderItem {self.order_id}-{self.product_id}>'
 
-    def serialize(self):
-        return {
+    def serialize(self, products=None):
+        # The snapshot taken at checkout is what the order shows. The live product is
+        # only embedded when the caller batch-loaded it ({product_id: Product}).
+        data = {
             "id": str(self.id),
             "order_id": str(self.order_id),
             "product_id": str(self.product_id),
             "product_variant_id": str(self.product_variant_id) if self.product_variant_id else None,
-            "product": self.product.serialize() if self.product else None,
             "quantity": self.quantity,
             "price": float(self.price) if self.price else None,
             "total": float(self.total) if self.total else None,
             "product_snapshot": self.product_snapshot
-        }
\ No newline at end of file
+        }
+        if products is not None:
+            product = products.get(self.product_id)
+            data["product"] = product.serialize() if product else None
+        return data
+
+class CacheInvalidation(db.Model):
+    __tablename__ = 'cache_invalidations'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    keys = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<CacheInvalidation {self.id}>'
+
+class StockReservation(db.Model):
+    __tablename__ = 'stock_reservations'
+    
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False, index=True)
+    product_id = db.Column(UUID(as_uuid=True), db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<StockReservation {self.user_id}-{self.product_id}>'
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'key', name='uq_idempotency_keys_user_key'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='processing')
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    locked_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key}>'
+
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    __table_args__ = (
+        db.Index('ix_outbox_events_status_available', 'status', 'available_at'),
+    )
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    topic = db.Column(db.String(100), nullable=False)
+    payload = db.Column(JSONB, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    available_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime(timezone=True), nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.id} {self.topic}>'
+
+class CheckoutIntent(db.Model):
+    __tablename__ = 'checkout_intents'
+    
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), primary_key=True)
+    intent_id = db.Column(db.String(255), nullable=False)
+    client_secret = db.Column(db.String(255), nullable=False)
+    cart_hash = db.Column(db.String(64), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    currency = db.Column(db.String(3), nullable=False)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CheckoutIntent {self.intent_id}>'
@@ -0,0 +1,160 @@
+"""
+Transactional outbox for side effects of writes, like order confirmation emails.
+
+enqueue() adds the event in the caller's transaction, so it exists exactly when
+the write it describes was committed, and the request never waits for the side
+effect. `flask outbox-worker` claims due events in batches with FOR UPDATE SKIP
+LOCKED, so several workers can run side by side, and hands each one to the
+handlers registered for its topic. A failing event is retried with exponential
+backoff and parked as 'failed' after OUTBOX_MAX_ATTEMPTS. Delivery is at least
+once: handlers must tolerate seeing the same event (event.id) twice. Processed
+events are kept for OUTBOX_RETENTION_DAYS; the worker purges them hourly, and
+`flask purge-outbox-events` does it on demand.
+"""
+
+import os
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, insert, select
+
+from api.models import db, OutboxEvent
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 10))
+RETRY_BASE = timedelta(seconds=5)
+RETRY_MAX = timedelta(hours=1)
+OUTBOX_RETENTION = timedelta(days=int(os.getenv('OUTBOX_RETENTION_DAYS', 7)))
+PURGE_INTERVAL = 3600
+
+_handlers = {}
+
+
+def outbox_handler(topic):
+    """Register callback(event) for the events of `topic`."""
+    def register(callback):
+        _handlers.setdefault(topic, []).append(callback)
+        return callback
+    return register
+
+
+def enqueue(topic, payload, delay=None):
+    """Add an event to the current transaction; the caller commits."""
+    now = datetime.utcnow()
+    db.session.execute(insert(OutboxEvent.__table__).values(
+        topic=topic, payload=payload, status='pending', attempts=0,
+        available_at=now + delay if delay else now, created_at=now
+    ))
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE * 2 ** (attempts - 1), RETRY_MAX)
+
+
+def _dispatch(event):
+    for callback in _handlers.get(event.topic, []):
+        callback(event)
+
+
+def process_batch(batch_size=OUTBOX_BATCH_SIZE):
+    """Claim and dispatch one batch of due events; returns (done, failed)."""
+    now = datetime.utcnow()
+    events = db.session.scalars(
+        select(OutboxEvent)
+        .where(OutboxEvent.status == 'pending', OutboxEvent.available_at <= now)
+        .order_by(OutboxEvent.available_at, OutboxEvent.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+
+    done = failed = 0
+    for event in events:
+        event.attempts += 1
+        try:
+            # A savepoint per event, so a handler's database writes are undone
+            # with its failure without losing the rest of the batch.
+            with db.session.begin_nested():
+                _dispatch(event)
+        except Exception:
+            failed += 1
+            event.last_error = traceback.format_exc(limit=5)
+            if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                event.status = 'failed'
+                print(f"❌ Evento {event.id} ({event.topic}) descartado tras {event.attempts} intentos")
+            else:
+                event.available_at = datetime.utcnow() + retry_delay(event.attempts)
+        else:
+            done += 1
+            event.status = 'done'
+            event.last_error = None
+            event.processed_at = datetime.utcnow()
+    db.session.commit()
+    return done, failed
+
+
+def purge_processed(batch_size=1000):
+    """Delete events processed more than OUTBOX_RETENTION ago; failed ones are kept."""
+    events = OutboxEvent.__table__
+    purged = 0
+    while True:
+        processed = (
+            select(events.c.id)
+            .where(events.c.status == 'done', events.c.processed_at < datetime.utcnow() - OUTBOX_RETENTION)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        count = db.session.execute(delete(events).where(events.c.id.in_(processed))).rowcount
+        db.session.commit()
+        purged += count
+        if count < batch_size:
+            return purged
+
+
+def run_worker(batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_INTERVAL, once=False):
+    print(f"📮 Outbox worker: lotes de {batch_size}, espera {poll_interval}s")
+    last_purge = None
+    while True:
+        if not once and (last_purge is None or time.monotonic() - last_purge > PURGE_INTERVAL):
+            try:
+                purged = purge_processed()
+                if purged:
+                    print(f"🧹 Eventos procesados borrados: {purged}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️  Error purgando la outbox: {e}")
+            last_purge = time.monotonic()
+
+        try:
+            done, failed = process_batch(batch_size)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Error procesando la outbox: {e}")
+            done, failed = 0, 0
+            if once:
+                raise
+        if done or failed:
+            print(f"📮 Eventos procesados: {done}, con error: {failed}")
+        if once and done + failed < batch_size:
+            return
+        if done + failed < batch_size:
+            time.sleep(poll_interval)
+
+
+def setup_outbox(app):
+
+    @app.cli.command('outbox-worker')
+    @click.option('--batch-size', default=OUTBOX_BATCH_SIZE, help='Eventos reclamados por transacción')
+    @click.option('--interval', default=OUTBOX_POLL_INTERVAL, help='Segundos de espera cuando no hay eventos')
+    @click.option('--once', is_flag=True, help='Vacía los eventos pendientes y termina')
+    def outbox_worker(batch_size, interval, once):
+        """Dispatch pending outbox events to their handlers."""
+        run_worker(batch_size, interval, once)
+
+    @app.cli.command('purge-outbox-events')
+    @click.option('--batch-size', default=1000, help='Eventos borrados por transacción')
+    def purge_outbox_events(batch_size):
+        """Delete processed outbox events older than OUTBOX_RETENTION_DAYS."""
+        print(f"🧹 Eventos procesados borrados: {purge_processed(batch_size)}")
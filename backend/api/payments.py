@@ -0,0 +1,109 @@
+"""
+One Stripe PaymentIntent per user and checkout, reused across page reloads.
+
+The intent is stored against a hash of the cart lines and amount. While the cart
+is unchanged the stored client secret is returned without calling Stripe (after
+INTENT_FRESHNESS its status is checked once with Stripe first); when
+the amount changes the same intent is updated with PaymentIntent.modify, and a
+new one is only created when there is none or Stripe no longer accepts changes
+to it (it was paid or canceled). confirm-payment forgets the intent.
+"""
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import stripe
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from api.models import db, CheckoutIntent
+
+CURRENCY = 'eur'
+INTENT_FRESHNESS = timedelta(seconds=int(os.getenv('STRIPE_INTENT_FRESHNESS', 300)))
+# States in which the client can still pay the intent
+REUSABLE_STATUSES = ('requires_payment_method', 'requires_confirmation', 'requires_action')
+
+
+def cart_hash(cart_items, amount):
+    digest = hashlib.sha256(f'{CURRENCY}:{amount}\n'.encode('utf-8'))
+    for line in sorted(f'{item.product_id}:{item.product_variant_id or ""}:{item.quantity}:{item.price}'
+                       for item in cart_items):
+        digest.update(f'{line}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _save(user_id, intent_id, client_secret, lines_hash, amount):
+    table = CheckoutIntent.__table__
+    insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    values = dict(intent_id=intent_id, client_secret=client_secret, cart_hash=lines_hash,
+                  amount=amount, currency=CURRENCY, updated_at=datetime.utcnow())
+    db.session.execute(
+        insert(table).values(user_id=user_id, **values)
+        .on_conflict_do_update(index_elements=['user_id'], set_=values)
+    )
+
+
+def _stored_intent(user_id):
+    """(stored intent, fresh), with None when Stripe says it can no longer be paid.
+
+    An intent saved or checked within INTENT_FRESHNESS is trusted as is; an older
+    one is checked with PaymentIntent.retrieve, since the client may have paid it
+    and never reached confirm-payment.
+    """
+    row = db.session.execute(
+        select(CheckoutIntent, CheckoutIntent.updated_at > datetime.utcnow() - INTENT_FRESHNESS)
+        .where(CheckoutIntent.user_id == user_id)
+    ).first()
+    if row is None:
+        return None, False
+    cached, fresh = row
+    if fresh:
+        return cached, True
+    try:
+        intent = stripe.PaymentIntent.retrieve(cached.intent_id)
+    except stripe.error.InvalidRequestError as e:
+        print(f"⚠️  PaymentIntent {cached.intent_id} no encontrado, se crea otro: {e}")
+        return None, False
+    if intent.status not in REUSABLE_STATUSES:
+        return None, False
+    return cached, False
+
+
+def payment_intent_for_cart(user, cart_items, total):
+    """Client secret of a PaymentIntent for the cart's total, reusing the user's last one.
+
+    The caller commits, so the stored intent follows the fate of the request.
+    """
+    amount = int(total * 100)
+    lines_hash = cart_hash(cart_items, amount)
+    cached, fresh = _stored_intent(user.id)
+
+    if cached is not None and cached.amount == amount and cached.currency == CURRENCY:
+        # Same total (maybe different lines): Stripe has nothing to update. The row
+        # is only rewritten for new lines or to record that Stripe was just checked.
+        if cached.cart_hash != lines_hash or not fresh:
+            _save(user.id, cached.intent_id, cached.client_secret, lines_hash, amount)
+        return cached.client_secret
+
+    intent = None
+    if cached is not None:
+        try:
+            intent = stripe.PaymentIntent.modify(cached.intent_id, amount=amount)
+        except stripe.error.InvalidRequestError as e:
+            print(f"⚠️  PaymentIntent {cached.intent_id} no modificable, se crea otro: {e}")
+    if intent is None:
+        intent = stripe.PaymentIntent.create(
+            amount=amount,
+            currency=CURRENCY,
+            metadata={
+                'user_id': str(user.id),
+                'user_email': user.email
+            }
+        )
+    _save(user.id, intent.id, intent.client_secret, lines_hash, amount)
+    return intent.client_secret
+
+
+def forget_payment_intent(user_id):
+    db.session.execute(delete(CheckoutIntent).where(CheckoutIntent.user_id == user_id))
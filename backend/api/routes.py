@@ -2,20 +2,50 @@ import uuid
 import os
 import secrets
 from datetime import datetime
+from decimal import Decimal
 from email_validator import validate_email, EmailNotValidError
-from sqlalchemy import or_
+from sqlalchemy import and_, delete, func, insert, literal, or_, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, load_only
+from sqlalchemy.orm.attributes import set_committed_value
 
 import stripe
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import create_access_token, jwt_required, get_current_user
 
-from api.models import db, User, Product, CartItem, Order, OrderItem, Category, OrderStatusEnum, PaymentStatusEnum
-from api.utils import APIException
+from api.models import db, User, Product, ProductVariant, CartItem, Order, OrderItem, Category, OrderStatusEnum, PaymentStatusEnum
+from api.utils import APIException, encode_cursor, decode_cursor
+from api.search import apply_search
+from api.facets import parse_facets, compute_facets
+from api.cache import catalog_cache, cached_response
+from api.invalidation import publish, product_changed
+from api.suggest import suggest_index, MAX_SUGGESTIONS
+from api.inventory import reserve_stock, take_stock, set_stock, available_to, RESERVATION_TTL
+from api.idempotency import idempotent
+from api.outbox import enqueue
+from api.payments import payment_intent_for_cart, forget_payment_intent
+from api.guest_cart import read_guest_cart, dump_guest_cart, save_guest_cart, clear_guest_cart, MAX_GUEST_CART_LINES
 
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
+# Point at a local stub of the Stripe API (e.g. stripe-mock on http://localhost:12111) in tests
+if os.getenv('STRIPE_API_BASE'):
+    stripe.api_base = os.getenv('STRIPE_API_BASE')
 
 api = Blueprint('api', __name__)
 
+MAX_PER_PAGE = 100
+MAX_BATCH_SIZE = 200
+
+# sort parameter -> (column, descending). Unknown values keep the default order.
+PRODUCT_SORTS = {
+    'newest': ('created_at', True),
+    'created_at': ('created_at', True),
+    'price_asc': ('price', False),
+    'price': ('price', False),
+    'price_desc': ('price', True)
+}
+
 @api.route('/register', methods=['POST'])
 def register():
     try:
@@ -53,12 +83,18 @@ def register():
         db.session.commit()
         
         access_token = create_access_token(identity=user)
+        user_data = user.serialize()
+        merged = _merge_guest_cart(user.id)
         
-        return jsonify({
+        response = jsonify({
             "message": "Usuario registrado exitosamente",
-            "user": user.serialize(),
-            "access_token": access_token
-        }), 201
+            "user": user_data,
+            "access_token": access_token,
+            "guest_cart_merged": merged or 0
+        })
+        if merged is not None:
+            clear_guest_cart(response)
+        return response, 201
         
     except APIException as e:
         raise e
@@ -82,12 +118,18 @@ def login():
             raise APIException("Cuenta desactivada", status_code=401)
         
         access_token = create_access_token(identity=user)
+        user_data = user.serialize()
+        merged = _merge_guest_cart(user.id)
         
-        return jsonify({
+        response = jsonify({
             "message": "Login exitoso",
-            "user": user.serialize(),
-            "access_token": access_token
-        }), 200
+            "user": user_data,
+            "access_token": access_token,
+            "guest_cart_merged": merged or 0
+        })
+        if merged is not None:
+            clear_guest_cart(response)
+        return response, 200
         
     except APIException as e:
         raise e
@@ -125,6 +167,7 @@ def update_profile():
             except EmailNotValidError:
                 raise APIException("Email no válido", status_code=400)
         
+        publish(f'user:{current_user.id}')
         db.session.commit()
         
         return jsonify({
@@ -144,6 +187,7 @@ def delete_profile():
         current_user = get_current_user()
         
         current_user.is_active = False
+        publish(f'user:{current_user.id}')
         db.session.commit()
         
         return jsonify({"message": "Cuenta desactivada exitosamente"}), 200
@@ -154,52 +198,106 @@ def delete_profile():
 @api.route('/products', methods=['GET'])
 def get_products():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 12, type=int)
-        category_param = request.args.get('category')
-        search = request.args.get('search')
-        featured = request.args.get('featured')
-        
-        print(f"🔍 Parámetros recibidos: page={page}, category={category_param}, search={search}")
-        
-        query = Product.query.filter_by(is_active=True)
-        
-        if category_param:
-            try:
-                uuid.UUID(category_param)
-                query = query.filter_by(category_id=category_param)
-                print(f"✅ Filtrando por category_id (UUID): {category_param}")
-            except ValueError:
-                category = Category.query.filter_by(slug=category_param, is_active=True).first()
-                if category:
-                    query = query.filter_by(category_id=category.id)
-                    print(f"✅ Filtrando por slug '{category_param}', encontrado ID: {category.id}")
-                else:
-                    print(f"❌ Categoría no encontrada: {category_param}")
-                    return jsonify({
-                        "products": [],
-                        "pagination": {
-                            "page": page,
-                            "per_page": per_page,
-                            "total": 0,
-                            "pages": 0,
-                            "has_next": False,
-                            "has_prev": False
-                        }
-                    }), 200
-        
-        if search:
-            query = query.filter(or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.description.ilike(f'%{search}%')
-            ))
-            print(f"🔍 Aplicando búsqueda: {search}")
+        cache_key = ('products', tuple(sorted(request.args.items(multi=True))))
+        return cached_response(cache_key, lambda: _query_products(request.args))
         
-        if featured:
-            query = query.filter_by(is_featured=True)
-            print("⭐ Filtrando productos destacados")
+    except APIException as e:
+        raise e
+    except Exception as e:
+        print(f"❌ Error en get_products: {str(e)}")
+        raise APIException(f"Error al obtener productos: {str(e)}", status_code=500)
+
+def _parse_fields(args):
+    fields = args.get('fields')
+    if not fields:
+        return None
+    
+    fields = sorted({field.strip() for field in fields.split(',') if field.strip()})
+    unknown = [field for field in fields if field not in Product.SERIALIZERS]
+    if unknown:
+        raise APIException(f"Campos desconocidos: {', '.join(unknown)}", status_code=400)
+    return fields
+
+# Columns a serialized field reads besides its own
+FIELD_COLUMNS = {
+    'stock_quantity': ('stock_shards', 'available_quantity'),
+}
+
+def _load_only_fields(query, fields, *extra):
+    if not fields:
+        return query
+    columns = set(fields) | {'created_at', 'updated_at', *extra}
+    for field in fields:
+        columns.update(FIELD_COLUMNS.get(field, ()))
+    return query.options(load_only(*[getattr(Product, column) for column in columns]))
+
+def _last_modified(items):
+    timestamps = [item.updated_at for item in items if item.updated_at]
+    return max(timestamps) if timestamps else None
+
+def _query_products(args):
+    page = args.get('page', 1, type=int)
+    per_page = min(max(args.get('per_page', 12, type=int), 1), MAX_PER_PAGE)
+    cursor = args.get('cursor')
+    include_total = args.get('include_total') in ('1', 'true')
+    category_param = args.get('category')
+    search = args.get('search')
+    featured = args.get('featured')
+    tags = [tag.strip() for tag in args.get('tags', '').split(',') if tag.strip()]
+    tags_match = args.get('tags_match', 'any')
+    min_price = args.get('min_price', type=float)
+    max_price = args.get('max_price', type=float)
+    sort = args.get('sort')
+    fields = _parse_fields(args)
+    facets = parse_facets(args)
+    sort_column, descending = PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest'])
+    
+    print(f"🔍 Parámetros recibidos: page={page}, cursor={cursor}, category={category_param}, search={search}")
+    
+    query = _load_only_fields(Product.query.filter_by(is_active=True), fields, sort_column)
+    
+    if category_param:
+        try:
+            uuid.UUID(category_param)
+            category = Category.query.filter_by(id=category_param).first()
+        except ValueError:
+            category = Category.query.filter_by(slug=category_param, is_active=True).first()
         
-        products = query.order_by(Product.created_at.desc()).paginate(
+        if category:
+            query = query.filter(Product.category_id.in_(category.subtree_ids()))
+            print(f"✅ Filtrando por la categoría '{category.slug}' y sus subcategorías, ID: {category.id}")
+        else:
+            print(f"❌ Categoría no encontrada: {category_param}")
+            query = query.filter(db.false())
+    
+    rank_order = None
+    if search:
+        query, rank_order = apply_search(query, search)
+        print(f"🔍 Aplicando búsqueda: {search}")
+    
+    if featured:
+        query = query.filter_by(is_featured=True)
+        print("⭐ Filtrando productos destacados")
+    
+    if tags:
+        if db.session.get_bind().dialect.name != 'postgresql':
+            raise APIException("El filtro por etiquetas requiere PostgreSQL", status_code=400)
+        query = query.filter(Product.tags.contains(tags) if tags_match == 'all' else Product.tags.overlap(tags))
+    
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    
+    order_column = getattr(Product, sort_column)
+    order = [order_column.desc(), Product.id.desc()] if descending else [order_column.asc(), Product.id.asc()]
+    if rank_order is not None and sort not in PRODUCT_SORTS:
+        order.insert(0, rank_order)
+    
+    if cursor is not None:
+        payload, last_modified = _paginate_by_cursor(query, cursor, per_page, include_total, fields, sort_column, descending)
+    else:
+        products = query.order_by(*order).paginate(
             page=page, 
             per_page=per_page, 
             error_out=False
@@ -207,8 +305,8 @@ def get_products():
         
         print(f"📊 Productos encontrados: {products.total}")
         
-        return jsonify({
-            "products": [product.serialize() for product in products.items],
+        payload, last_modified = {
+            "products": [product.serialize(fields) for product in products.items],
             "pagination": {
                 "page": page,
                 "per_page": per_page,
@@ -217,21 +315,152 @@ def get_products():
                 "has_next": products.has_next,
                 "has_prev": products.has_prev
             }
+        }, _last_modified(products.items)
+    
+    if facets:
+        payload["facets"] = _cached_facets(query, facets, args)
+    
+    return payload, last_modified
+
+def _cached_facets(query, facets, args):
+    # Facet counts only depend on the filters, not on the page being requested.
+    filters = tuple(sorted(
+        (key, value) for key, value in args.items(multi=True)
+        if key not in ('page', 'per_page', 'cursor', 'include_total', 'fields', 'facets', 'sort')
+    ))
+    cache_key = ('products', 'facets', filters, tuple(facets))
+    result = catalog_cache.get(cache_key)
+    if result is None:
+        result = compute_facets(query, facets)
+        catalog_cache.set(cache_key, result)
+    return result
+
+def _paginate_by_cursor(query, cursor, per_page, include_total=False, fields=None, sort_column='created_at', descending=True):
+    total = query.order_by(None).count() if include_total else None
+    column = getattr(Product, sort_column)
+    
+    if cursor:
+        value, product_id = decode_cursor(cursor)
+        try:
+            value = datetime.fromisoformat(value) if sort_column == 'created_at' else Decimal(value)
+            product_id = uuid.UUID(product_id)
+        except (ValueError, ArithmeticError):
+            raise APIException("Cursor inválido", status_code=400)
+        position = tuple_(column, Product.id)
+        query = query.filter(position < (value, product_id) if descending else position > (value, product_id))
+    
+    order = [column.desc(), Product.id.desc()] if descending else [column.asc(), Product.id.asc()]
+    products = query.order_by(*order).limit(per_page + 1).all()
+    has_next = len(products) > per_page
+    products = products[:per_page]
+    
+    return {
+        "products": [product.serialize(fields) for product in products],
+        "pagination": {
+            "per_page": per_page,
+            "next_cursor": encode_cursor(getattr(products[-1], sort_column), products[-1].id) if has_next else None,
+            "has_next": has_next,
+            "total": total
+        }
+    }, _last_modified(products)
+
+@api.route('/products/suggest', methods=['GET'])
+def suggest_products():
+    try:
+        query = request.args.get('q', '')
+        limit = min(max(request.args.get('limit', 8, type=int), 1), MAX_SUGGESTIONS)
+        
+        return jsonify({
+            "query": query,
+            "suggestions": suggest_index.suggest(query, limit)
         }), 200
         
     except Exception as e:
-        print(f"❌ Error en get_products: {str(e)}")
+        raise APIException(f"Error al obtener sugerencias: {str(e)}", status_code=500)
+
+@api.route('/products/batch', methods=['GET'])
+def get_products_batch():
+    try:
+        keys = []
+        for value in request.args.getlist('ids'):
+            keys += [key.strip() for key in value.split(',') if key.strip()]
+        keys = list(dict.fromkeys(keys))
+
+        if not keys:
+            raise APIException("El parámetro ids es requerido", status_code=400)
+        if len(keys) > MAX_BATCH_SIZE:
+            raise APIException(f"Máximo {MAX_BATCH_SIZE} productos por petición", status_code=400)
+
+        fields = _parse_fields(request.args)
+        products = _load_products_batch(keys, fields)
+
+        return jsonify({
+            "products": products,
+            "not_found": [key for key, product in products.items() if product is None]
+        }), 200
+
+    except APIException as e:
+        raise e
+    except Exception as e:
         raise APIException(f"Error al obtener productos: {str(e)}", status_code=500)
 
+def _load_products_batch(keys, fields=None):
+    """Resolve ids or slugs to serialized products, None when missing or inactive.
+
+    Products already in the catalog cache are served from it; the rest are fetched
+    with a single IN query and cached under their id, next to get_product's entries
+    so the same invalidation drops both.
+    """
+    field_key = tuple(fields or ())
+    result = dict.fromkeys(keys)
+    ids = {}
+    slugs = []
+
+    for key in keys:
+        try:
+            product_id = str(uuid.UUID(key))
+        except ValueError:
+            slugs.append(key)
+            continue
+        cached = catalog_cache.get(('product', product_id, 'batch', field_key))
+        if cached is not None:
+            result[key] = cached
+        else:
+            # Several spellings of one UUID (case, braces, no dashes) share the row
+            ids.setdefault(product_id, []).append(key)
+
+    if ids or slugs:
+        query = _load_only_fields(Product.query.filter_by(is_active=True), fields, 'id', 'slug')
+        for product in query.filter(or_(Product.id.in_(list(ids)), Product.slug.in_(slugs))).all():
+            product_id = str(product.id)
+            data = product.serialize(fields)
+            catalog_cache.set(('product', product_id, 'batch', field_key), data)
+            for key in ids.get(product_id, ()):
+                result[key] = data
+            if product.slug in result:
+                result[product.slug] = data
+
+    return result
+
 @api.route('/products/<product_id>', methods=['GET'])
 def get_product(product_id):
     try:
-        product = Product.query.filter_by(id=product_id, is_active=True).first()
-        
-        if not product:
+        try:
+            product_id = str(uuid.UUID(product_id))
+        except ValueError:
             raise APIException("Producto no encontrado", status_code=404)
         
-        return jsonify(product.serialize()), 200
+        fields = _parse_fields(request.args)
+        
+        def load():
+            product = _load_only_fields(Product.query, fields).filter_by(id=product_id, is_active=True).first()
+            
+            if not product:
+                raise APIException("Producto no encontrado", status_code=404)
+            
+            return product.serialize(fields), product.updated_at
+        
+        return cached_response(('product', product_id, tuple(fields or ())), load)
         
     except APIException as e:
         raise e
@@ -241,45 +470,121 @@ def get_product(product_id):
 @api.route('/categories', methods=['GET'])
 def get_categories():
     try:
-        print("📂 Cargando categorías...")
-        categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
-        
-        category_list = []
-        for cat in categories:
-            category_data = {
-                "value": str(cat.id),
-                "label": cat.name,
-                "slug": cat.slug,
-                "id": str(cat.id)
-            }
-            category_list.append(category_data)
-            print(f"✅ Categoría: {cat.name} -> ID: {cat.id}, Slug: {cat.slug}")
-        
-        print(f"📊 Total categorías encontradas: {len(category_list)}")
-        return jsonify(category_list), 200
+        return cached_response(('categories',), _query_categories)
         
     except Exception as e:
         print(f"❌ Error en get_categories: {str(e)}")
         raise APIException(f"Error al obtener categorías: {str(e)}", status_code=500)
 
+def _query_categories():
+    print("📂 Cargando categorías...")
+    categories = Category.query.filter_by(is_active=True).order_by(Category.sort_order, Category.name).all()
+    
+    category_list = []
+    for cat in categories:
+        category_data = {
+            "value": str(cat.id),
+            "label": cat.name,
+            "slug": cat.slug,
+            "id": str(cat.id)
+        }
+        category_list.append(category_data)
+        print(f"✅ Categoría: {cat.name} -> ID: {cat.id}, Slug: {cat.slug}")
+    
+    print(f"📊 Total categorías encontradas: {len(category_list)}")
+    return category_list, _last_modified(categories)
+
+def _load_cart(user_id):
+    """Cart lines with their product and variant, plus the totals, in one query.
+
+    The subtotal and line count are window aggregates computed by the database on
+    the same rows, so reading a cart is a single statement whatever its size.
+    """
+    rows = db.session.query(
+        CartItem,
+        func.sum(CartItem.price * CartItem.quantity).over(),
+        func.count().over()
+    ).options(
+        joinedload(CartItem.product),
+        joinedload(CartItem.product_variant)
+    ).filter(CartItem.user_id == user_id).order_by(CartItem.created_at, CartItem.id).all()
+    
+    if not rows:
+        return [], Decimal('0'), 0
+    return [row[0] for row in rows], Decimal(rows[0][1]), rows[0][2]
+
 @api.route('/cart', methods=['GET'])
 @jwt_required()
 def get_cart():
     try:
         current_user = get_current_user()
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-        
-        total = sum(item.price * item.quantity for item in cart_items)
+        cart_items, subtotal, count = _load_cart(current_user.id)
         
         return jsonify({
             "items": [item.serialize() for item in cart_items],
-            "total": float(total),
-            "count": len(cart_items)
+            "subtotal": float(subtotal),
+            "total": float(subtotal),
+            "count": count
         }), 200
         
     except Exception as e:
         raise APIException(f"Error al obtener carrito: {str(e)}", status_code=500)
 
+def _upsert_cart_line(user_id, product_id, variant_id, quantity):
+    """Add `quantity` to the cart line in one INSERT ... ON CONFLICT DO UPDATE.
+
+    The row to insert is selected from the product (and variant) only when it is
+    active and has enough stock, and the conflict update only fires when the stock
+    still covers the summed quantity. Returns (id, quantity) of the line, or None
+    when nothing was written.
+    """
+    dialect = db.session.get_bind().dialect.name
+    upsert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    now = datetime.utcnow()
+    
+    stock_column = ProductVariant.stock_quantity if variant_id else available_to(user_id)
+    price = func.coalesce(ProductVariant.price, Product.price) if variant_id else Product.price
+    source = select(
+        literal(uuid.uuid4(), CartItem.id.type),
+        literal(user_id, CartItem.user_id.type),
+        Product.id,
+        literal(variant_id, CartItem.product_variant_id.type),
+        literal(quantity),
+        price,
+        literal(now, CartItem.created_at.type),
+        literal(now, CartItem.updated_at.type)
+    ).where(Product.id == product_id, Product.is_active.is_(True), stock_column >= quantity)
+    if variant_id:
+        source = source.join(ProductVariant, ProductVariant.product_id == Product.id).where(
+            ProductVariant.id == variant_id, ProductVariant.is_active.is_(True))
+    
+    statement = upsert(CartItem).from_select(
+        ['id', 'user_id', 'product_id', 'product_variant_id', 'quantity', 'price', 'created_at', 'updated_at'],
+        source
+    )
+    if variant_id:
+        stock = select(ProductVariant.stock_quantity).where(ProductVariant.id == variant_id)
+        conflict = dict(index_elements=['user_id', 'product_id', 'product_variant_id'],
+                        index_where=CartItem.product_variant_id.isnot(None))
+    else:
+        stock = select(available_to(user_id)).where(Product.id == product_id)
+        conflict = dict(index_elements=['user_id', 'product_id'],
+                        index_where=CartItem.product_variant_id.is_(None))
+    statement = statement.on_conflict_do_update(
+        **conflict,
+        set_={
+            'quantity': CartItem.quantity + statement.excluded.quantity,
+            'price': statement.excluded.price,
+            'updated_at': statement.excluded.updated_at
+        },
+        # The conflicting row is this user's line for the same product and variant,
+        # so the stock is looked up by the bound ids: `excluded` inside a subquery
+        # would be read as a table of its own and match any cart line
+        where=stock.scalar_subquery() >= CartItem.quantity + statement.excluded.quantity
+    ).returning(CartItem.id, CartItem.quantity)
+    
+    return db.session.execute(statement).first()
+
 @api.route('/cart', methods=['POST'])
 @jwt_required()
 def add_to_cart():
@@ -290,43 +595,39 @@ def add_to_cart():
         if not body.get('product_id'):
             raise APIException("ID del producto es requerido", status_code=400)
         
-        product_id = body['product_id']
         quantity = body.get('quantity', 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            raise APIException("Cantidad inválida", status_code=400)
         
-        product = Product.query.filter_by(id=product_id, is_active=True).first()
-        if not product:
+        try:
+            product_id = uuid.UUID(str(body['product_id']))
+            variant_id = uuid.UUID(str(body['product_variant_id'])) if body.get('product_variant_id') else None
+        except ValueError:
             raise APIException("Producto no encontrado", status_code=404)
         
-        if product.stock_quantity < quantity:
-            raise APIException("Stock insuficiente", status_code=400)
-        
-        existing_item = CartItem.query.filter_by(
-            user_id=current_user.id, 
-            product_id=product_id
-        ).first()
+        line = _upsert_cart_line(current_user.id, product_id, variant_id, quantity)
         
-        if existing_item:
-            new_quantity = existing_item.quantity + quantity
-            if product.stock_quantity < new_quantity:
-                raise APIException("Stock insuficiente", status_code=400)
-            existing_item.quantity = new_quantity
-            existing_item.price = product.price
-        else:
-            cart_item = CartItem(
-                user_id=current_user.id,
-                product_id=product_id,
-                quantity=quantity,
-                price=product.price
-            )
-            db.session.add(cart_item)
+        if line is None:
+            # Only the failure path pays for a second query, to pick the right error.
+            db.session.rollback()
+            if not Product.query.filter_by(id=product_id, is_active=True).first():
+                raise APIException("Producto no encontrado", status_code=404)
+            if variant_id and not ProductVariant.query.filter_by(id=variant_id, product_id=product_id, is_active=True).first():
+                raise APIException("Variante no encontrada", status_code=404)
+            raise APIException("Stock insuficiente", status_code=400)
         
         db.session.commit()
         
-        return jsonify({"message": "Producto agregado al carrito"}), 201
+        return jsonify({
+            "message": "Producto agregado al carrito",
+            "item_id": str(line.id),
+            "quantity": line.quantity
+        }), 201
         
     except APIException as e:
         raise e
     except Exception as e:
+        db.session.rollback()
         raise APIException(f"Error al agregar al carrito: {str(e)}", status_code=500)
 
 @api.route('/cart/<item_id>', methods=['PUT'])
@@ -346,7 +647,8 @@ def update_cart_item(item_id):
         
         quantity = body.get('quantity', 1)
         
-        if cart_item.product.stock_quantity < quantity:
+        available = db.session.scalar(select(available_to(current_user.id)).where(Product.id == cart_item.product_id))
+        if available < quantity:
             raise APIException("Stock insuficiente", status_code=400)
         
         cart_item.quantity = quantity
@@ -383,6 +685,279 @@ def remove_from_cart(item_id):
     except Exception as e:
         raise APIException(f"Error al eliminar del carrito: {str(e)}", status_code=500)
 
+CART_OPERATIONS = ('add', 'set', 'remove')
+
+def _parse_cart_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise APIException("Se requiere una lista de operaciones", status_code=400)
+    if len(operations) > MAX_BATCH_SIZE:
+        raise APIException(f"Máximo {MAX_BATCH_SIZE} operaciones por petición", status_code=400)
+    
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise APIException(f"Operación {index}: op debe ser add, set o remove", status_code=400)
+        try:
+            product_id = uuid.UUID(str(operation.get('product_id')))
+            variant_id = uuid.UUID(str(operation['product_variant_id'])) if operation.get('product_variant_id') else None
+        except ValueError:
+            raise APIException(f"Operación {index}: producto inválido", status_code=400)
+        
+        quantity = operation.get('quantity', 1 if operation['op'] == 'add' else 0)
+        minimum = 1 if operation['op'] == 'add' else 0
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < minimum:
+            raise APIException(f"Operación {index}: cantidad inválida", status_code=400)
+        
+        parsed.append((operation['op'], (product_id, variant_id), quantity))
+    return parsed
+
+def _fold_cart_operations(current, operations):
+    """Final quantity of every line touched by the operations, 0 meaning removed."""
+    quantities = {}
+    for op, key, quantity in operations:
+        previous = quantities.get(key, current.get(key, 0))
+        quantities[key] = previous + quantity if op == 'add' else quantity if op == 'set' else 0
+    return quantities
+
+def _apply_cart_operations(user_id, operations, clamp=False):
+    """Apply parsed (op, (product_id, variant_id), quantity) operations to a cart.
+
+    Current lines and the catalog rows are read with one query each, every final
+    quantity is checked against stock, and then deletes, updates and inserts go
+    out as one batched statement each. Nothing is written if any line fails,
+    unless `clamp` is set: then unavailable lines are skipped and added units are
+    capped at the stock, without going below the quantity already in the cart.
+    The caller commits.
+    """
+    current = {
+        (row.product_id, row.product_variant_id): row
+        for row in db.session.execute(
+            select(CartItem.id, CartItem.product_id, CartItem.product_variant_id, CartItem.quantity)
+            .where(CartItem.user_id == user_id)
+            .with_for_update()
+        )
+    }
+    
+    quantities = _fold_cart_operations({key: row.quantity for key, row in current.items()}, operations)
+    
+    wanted = [key for key, quantity in quantities.items() if quantity > 0]
+    catalog = {}
+    if wanted:
+        rows = db.session.execute(
+            select(Product.id, Product.price, available_to(user_id).label('available_quantity'), Product.is_active,
+                   ProductVariant.id.label('variant_id'), ProductVariant.price.label('variant_price'),
+                   ProductVariant.stock_quantity.label('variant_stock'), ProductVariant.is_active.label('variant_active'))
+            .outerjoin(ProductVariant, and_(
+                ProductVariant.product_id == Product.id,
+                ProductVariant.id.in_([variant_id for _, variant_id in wanted if variant_id])
+            ))
+            .where(Product.id.in_({product_id for product_id, _ in wanted}))
+        )
+        for row in rows:
+            catalog[(row.id, None)] = (row.is_active, row.available_quantity, row.price)
+            if row.variant_id:
+                catalog[(row.id, row.variant_id)] = (
+                    row.is_active and row.variant_active, row.variant_stock, row.variant_price or row.price)
+    
+    errors = []
+    for product_id, variant_id in wanted:
+        is_active, stock, price = catalog.get((product_id, variant_id), (False, 0, None))
+        if clamp:
+            # Only what the operations add is capped: a line the user already had is
+            # never shrunk or dropped because stock ran low since.
+            key = (product_id, variant_id)
+            existing = current[key].quantity if key in current else 0
+            quantities[key] = max(min(quantities[key], stock), existing) if is_active else existing
+            continue
+        if not is_active:
+            message = "Variante no encontrada" if variant_id else "Producto no encontrado"
+        elif stock < quantities[(product_id, variant_id)]:
+            message = "Stock insuficiente"
+        else:
+            continue
+        errors.append({
+            "product_id": str(product_id),
+            "product_variant_id": str(variant_id) if variant_id else None,
+            "message": message
+        })
+    if errors:
+        raise APIException("No se pudo actualizar el carrito", status_code=400, payload={"errors": errors})
+    
+    now = datetime.utcnow()
+    deletes, updates, inserts = [], [], []
+    for key, quantity in quantities.items():
+        if quantity == 0:
+            if key in current:
+                deletes.append(current[key].id)
+        elif key in current:
+            if quantity != current[key].quantity:
+                updates.append({"id": current[key].id, "quantity": quantity, "price": catalog[key][2], "updated_at": now})
+        else:
+            inserts.append({
+                "id": uuid.uuid4(),
+                "user_id": user_id,
+                "product_id": key[0],
+                "product_variant_id": key[1],
+                "quantity": quantity,
+                "price": catalog[key][2],
+                "created_at": now,
+                "updated_at": now
+            })
+    
+    if deletes:
+        db.session.execute(delete(CartItem).where(CartItem.id.in_(deletes)))
+    if updates:
+        db.session.execute(update(CartItem), updates)
+    if inserts:
+        # Core insert keeps it one executemany even when some variants are NULL.
+        db.session.execute(insert(CartItem.__table__), inserts)
+
+@api.route('/cart', methods=['PATCH'])
+@jwt_required()
+def update_cart():
+    try:
+        user_id = get_current_user().id
+        body = request.get_json() or {}
+        
+        operations = _parse_cart_operations(body.get('operations'))
+        _apply_cart_operations(user_id, operations)
+        db.session.commit()
+        
+        cart_items, subtotal, count = _load_cart(user_id)
+        
+        return jsonify({
+            "message": "Carrito actualizado",
+            "items": [item.serialize() for item in cart_items],
+            "subtotal": float(subtotal),
+            "total": float(subtotal),
+            "count": count
+        }), 200
+        
+    except APIException as e:
+        db.session.rollback()
+        raise e
+    except IntegrityError:
+        # A concurrent add inserted one of our new lines first.
+        db.session.rollback()
+        raise APIException("El carrito ha cambiado, inténtalo de nuevo", status_code=409)
+    except Exception as e:
+        db.session.rollback()
+        raise APIException(f"Error al actualizar carrito: {str(e)}", status_code=500)
+
+def _price_guest_cart(lines):
+    """Price guest cart lines against the catalog cache.
+
+    Products come from the same per-product cache entries as the batch endpoint;
+    only variants, when the cart has any, cost a query.
+    """
+    products = _load_products_batch([str(product_id) for product_id, _ in lines]) if lines else {}
+    variant_ids = [variant_id for _, variant_id in lines if variant_id]
+    variants = {
+        variant.id: variant
+        for variant in ProductVariant.query.filter(ProductVariant.id.in_(variant_ids), ProductVariant.is_active.is_(True))
+    } if variant_ids else {}
+    
+    items = []
+    subtotal = Decimal('0')
+    for (product_id, variant_id), quantity in lines.items():
+        product = products.get(str(product_id))
+        variant = variants.get(variant_id) if variant_id else None
+        if product is None or (variant_id and (variant is None or variant.product_id != product_id)):
+            message = "Variante no encontrada" if product and variant_id else "Producto no encontrado"
+            price = None
+        else:
+            stock = variant.stock_quantity if variant else product['available_quantity']
+            # The serializer writes a price of 0 as None
+            price = variant.price if variant and variant.price else Decimal(str(product['price'] or 0))
+            message = "Stock insuficiente" if stock < quantity else None
+        
+        if message is None:
+            subtotal += price * quantity
+        items.append({
+            "product_id": str(product_id),
+            "product_variant_id": str(variant_id) if variant_id else None,
+            "product": product,
+            "product_variant": variant.serialize() if variant else None,
+            "quantity": quantity,
+            "price": float(price) if price is not None else None,
+            "subtotal": float(price * quantity) if message is None else 0,
+            "available": message is None,
+            "message": message
+        })
+    return items, subtotal
+
+def _guest_cart_response(lines, message=None):
+    items, subtotal = _price_guest_cart(lines)
+    token = dump_guest_cart(lines)
+    body = {
+        "items": items,
+        "subtotal": float(subtotal),
+        "total": float(subtotal),
+        "count": len(items),
+        "guest_cart": token
+    }
+    if message:
+        body["message"] = message
+    response = jsonify(body)
+    save_guest_cart(response, token)
+    return response
+
+@api.route('/guest-cart', methods=['GET'])
+def get_guest_cart():
+    try:
+        return _guest_cart_response(read_guest_cart()), 200
+        
+    except Exception as e:
+        raise APIException(f"Error al obtener carrito: {str(e)}", status_code=500)
+
+@api.route('/guest-cart', methods=['PATCH'])
+def update_guest_cart():
+    try:
+        body = request.get_json() or {}
+        operations = _parse_cart_operations(body.get('operations'))
+        
+        lines = read_guest_cart()
+        changes = _fold_cart_operations(lines, operations)
+        lines.update(changes)
+        lines = {key: quantity for key, quantity in lines.items() if quantity > 0}
+        if len(lines) > MAX_GUEST_CART_LINES:
+            raise APIException(f"Máximo {MAX_GUEST_CART_LINES} productos en el carrito", status_code=400)
+        
+        items, _ = _price_guest_cart({key: lines[key] for key in changes if key in lines})
+        errors = [
+            {key: item[key] for key in ('product_id', 'product_variant_id', 'message')}
+            for item in items if not item['available']
+        ]
+        if errors:
+            raise APIException("No se pudo actualizar el carrito", status_code=400, payload={"errors": errors})
+        
+        return _guest_cart_response(lines, "Carrito actualizado"), 200
+        
+    except APIException as e:
+        raise e
+    except Exception as e:
+        raise APIException(f"Error al actualizar carrito: {str(e)}", status_code=500)
+
+def _merge_guest_cart(user_id):
+    """Move the request's guest cart into the user's cart_items in one batched write.
+
+    Guest lines that are no longer available are dropped and the guest's units are
+    capped at the stock, so a stale guest cart never blocks logging in; the lines
+    the user already had are kept as they were. Returns the merged line
+    count, or None when the merge failed and the guest cart should be kept.
+    """
+    lines = read_guest_cart()
+    if not lines:
+        return 0
+    try:
+        _apply_cart_operations(user_id, [('add', key, quantity) for key, quantity in lines.items()], clamp=True)
+        db.session.commit()
+        return len(lines)
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error fusionando carrito de invitado: {str(e)}")
+        return None
+
 @api.route('/cart/clear', methods=['DELETE'])
 @jwt_required()
 def clear_cart():
@@ -399,38 +974,97 @@ def clear_cart():
 
 @api.route('/create-payment-intent', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_payment_intent():
     try:
         current_user = get_current_user()
         
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+        cart_items, total, _ = _load_cart(current_user.id)
         
         if not cart_items:
             raise APIException("Carrito vacío", status_code=400)
         
-        total = sum(item.price * item.quantity for item in cart_items)
+        shortages = reserve_stock(current_user.id, cart_items)
+        if shortages:
+            raise APIException("Stock insuficiente", status_code=400, payload={"items": shortages})
         
-        intent = stripe.PaymentIntent.create(
-            amount=int(total * 100),
-            currency='eur',
-            metadata={
-                'user_id': str(current_user.id),
-                'user_email': current_user.email
-            }
-        )
+        client_secret = payment_intent_for_cart(current_user, cart_items, total)
+        
+        db.session.commit()
         
         return jsonify({
-            'client_secret': intent.client_secret,
-            'amount': float(total)
+            'client_secret': client_secret,
+            'amount': float(total),
+            'reserved_until': (datetime.utcnow() + RESERVATION_TTL).isoformat()
         }), 200
         
     except APIException as e:
+        db.session.rollback()
         raise e
     except Exception as e:
+        db.session.rollback()
         raise APIException(f"Error al crear intento de pago: {str(e)}", status_code=500)
 
+def _create_order(user_id, cart_items, subtotal, body):
+    """Write the order, its items and empty the cart with three statements.
+
+    The order id is generated here, so nothing has to be flushed to get it, and
+    every item goes into one multi-row INSERT whatever the size of the cart. The
+    returned order already holds its items; the caller commits.
+    """
+    shipping_amount = 0
+    tax_amount = 0
+    total_amount = subtotal + shipping_amount + tax_amount
+    order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{secrets.token_hex(4).upper()}"
+    now = datetime.utcnow()
+    
+    order = db.session.scalars(insert(Order).returning(Order), [{
+        "id": uuid.uuid4(),
+        "order_number": order_number,
+        "user_id": user_id,
+        "status": OrderStatusEnum.CONFIRMED,
+        "payment_status": PaymentStatusEnum.PAID,
+        "payment_method": body.get('payment_method', 'credit_card'),
+        "payment_intent_id": body.get('payment_intent_id'),
+        "subtotal": subtotal,
+        "tax_amount": tax_amount,
+        "shipping_amount": shipping_amount,
+        "discount_amount": 0,
+        "total_amount": total_amount,
+        "shipping_address": body.get('shipping_address'),
+        "billing_address": body.get('billing_address', body.get('shipping_address')),
+        "notes": body.get('notes'),
+        "created_at": now,
+        "updated_at": now
+    }]).one()
+    
+    items = db.session.scalars(insert(OrderItem).returning(OrderItem).values([
+        {
+            "id": uuid.uuid4(),
+            "order_id": order.id,
+            "product_id": cart_item.product_id,
+            "product_variant_id": cart_item.product_variant_id,
+            "quantity": cart_item.quantity,
+            "price": cart_item.price,
+            "total": cart_item.price * cart_item.quantity,
+            "product_snapshot": {
+                "name": cart_item.product.name,
+                "description": cart_item.product.description,
+                "image_url": cart_item.product.image_url,
+                "price": float(cart_item.price)
+            },
+            "created_at": now
+        }
+        for cart_item in cart_items
+    ])).all()
+    set_committed_value(order, 'order_items', items)
+    
+    db.session.execute(delete(CartItem).where(CartItem.user_id == user_id))
+    return order
+
 @api.route('/confirm-payment', methods=['POST'])
 @jwt_required()
+@idempotent
 def confirm_payment():
     try:
         current_user = get_current_user()
@@ -442,64 +1076,30 @@ def confirm_payment():
         if not payment_intent_id or not shipping_address:
             raise APIException("Datos de pago incompletos", status_code=400)
         
-        cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+        cart_items, subtotal, _ = _load_cart(current_user.id)
         
         if not cart_items:
             raise APIException("Carrito vacío", status_code=400)
         
-        subtotal = sum(item.price * item.quantity for item in cart_items)
-        shipping_amount = 0
-        tax_amount = 0
-        total_amount = subtotal + shipping_amount + tax_amount
-        
-        order_number = f"ORD-{datetime.now().strftime('%Y%m%d')}-{secrets.token_hex(4).upper()}"
-        
-        order = Order(
-            order_number=order_number,
-            user_id=current_user.id,
-            status=OrderStatusEnum.CONFIRMED,
-            payment_status=PaymentStatusEnum.PAID,
-            payment_method=body.get('payment_method', 'credit_card'),
-            payment_intent_id=payment_intent_id,
-            subtotal=subtotal,
-            tax_amount=tax_amount,
-            shipping_amount=shipping_amount,
-            total_amount=total_amount,
-            shipping_address=shipping_address,
-            billing_address=body.get('billing_address', shipping_address),
-            notes=body.get('notes')
-        )
-        db.session.add(order)
-        db.session.flush()
+        shortages = take_stock(current_user.id, cart_items)
+        if shortages:
+            raise APIException("Stock insuficiente", status_code=400, payload={"items": shortages})
         
-        for cart_item in cart_items:
-            if cart_item.product.stock_quantity < cart_item.quantity:
-                raise APIException(f"Stock insuficiente para {cart_item.product.name}", status_code=400)
-            
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=cart_item.product_id,
-                quantity=cart_item.quantity,
-                price=cart_item.price,
-                total=cart_item.price * cart_item.quantity,
-                product_snapshot={
-                    "name": cart_item.product.name,
-                    "description": cart_item.product.description,
-                    "image_url": cart_item.product.image_url,
-                    "price": float(cart_item.price)
-                }
-            )
-            db.session.add(order_item)
-            
-            cart_item.product.stock_quantity -= cart_item.quantity
-        
-        CartItem.query.filter_by(user_id=current_user.id).delete()
+        order = _create_order(current_user.id, cart_items, subtotal, body)
+        forget_payment_intent(current_user.id)
+        response = order.serialize()
+        enqueue('order.confirmed', {
+            "order_id": response["id"],
+            "order_number": order.order_number,
+            "user_id": str(current_user.id),
+            "total_amount": response["total_amount"]
+        })
         
         db.session.commit()
         
         return jsonify({
             "message": "Pago confirmado exitosamente",
-            "order": order.serialize()
+            "order": response
         }), 200
         
     except APIException as e:
@@ -509,15 +1109,87 @@ def confirm_payment():
         db.session.rollback()
         raise APIException(f"Error al confirmar pago: {str(e)}", status_code=500)
 
+def _load_order_summaries(user_id, cursor=None, per_page=20):
+    """One page of the user's orders, newest first, as summary rows in one query.
+
+    The line count and the first image come from correlated subqueries over
+    order_items, so neither the items nor the products are loaded.
+    """
+    item_count = select(func.count()).where(OrderItem.order_id == Order.id).scalar_subquery()
+    image_url = OrderItem.product_snapshot['image_url'].as_string()
+    first_image = select(image_url).where(
+        OrderItem.order_id == Order.id, image_url.isnot(None)
+    ).order_by(OrderItem.created_at, OrderItem.id).limit(1).scalar_subquery()
+    
+    query = db.session.query(
+        Order.id, Order.order_number, Order.status, Order.payment_status, Order.total_amount, Order.shipping_address,
+        Order.created_at,
+        item_count.label('item_count'), first_image.label('first_image')
+    ).filter(Order.user_id == user_id)
+    
+    if cursor:
+        created_at, order_id = decode_cursor(cursor)
+        try:
+            created_at = datetime.fromisoformat(created_at)
+            order_id = uuid.UUID(order_id)
+        except ValueError:
+            raise APIException("Cursor inválido", status_code=400)
+        query = query.filter(tuple_(Order.created_at, Order.id) < (created_at, order_id))
+    
+    rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    
+    return {
+        "orders": [{
+            "id": str(row.id),
+            "order_number": row.order_number,
+            "status": row.status.value if row.status else None,
+            "payment_status": row.payment_status.value if row.payment_status else None,
+            "total_amount": float(row.total_amount) if row.total_amount is not None else None,
+            "item_count": row.item_count,
+            "first_image": row.first_image,
+            "shipping_address": row.shipping_address,
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        } for row in rows],
+        "pagination": {
+            "per_page": per_page,
+            "next_cursor": encode_cursor(rows[-1].created_at, rows[-1].id) if has_next else None,
+            "has_next": has_next
+        }
+    }
+
+def _load_order(user_id, order_id):
+    """The order with all its items in one query, or None."""
+    return Order.query.options(joinedload(Order.order_items)).filter_by(id=order_id, user_id=user_id).first()
+
+ORDER_EXPANSIONS = ('product',)
+
+def _parse_expand(args):
+    expand = {value.strip() for value in args.get('expand', '').split(',') if value.strip()}
+    unknown = sorted(expand - set(ORDER_EXPANSIONS))
+    if unknown:
+        raise APIException(f"Expansiones desconocidas: {', '.join(unknown)}", status_code=400)
+    return expand
+
+def _load_order_products(order):
+    """Live products of the order's items in one query, as {product_id: Product}."""
+    product_ids = {item.product_id for item in order.order_items}
+    if not product_ids:
+        return {}
+    return {product.id: product for product in Product.query.filter(Product.id.in_(product_ids))}
+
 @api.route('/orders', methods=['GET'])
 @jwt_required()
 def get_orders():
     try:
         current_user = get_current_user()
-        orders = Order.query.filter_by(user_id=current_user.id).order_by(Order.created_at.desc()).all()
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), MAX_PER_PAGE)
         
-        return jsonify([order.serialize() for order in orders]), 200
+        return jsonify(_load_order_summaries(current_user.id, request.args.get('cursor'), per_page)), 200
         
+    except APIException as e:
+        raise e
     except Exception as e:
         raise APIException(f"Error al obtener órdenes: {str(e)}", status_code=500)
 
@@ -526,12 +1198,14 @@ def get_orders():
 def get_order(order_id):
     try:
         current_user = get_current_user()
-        order = Order.query.filter_by(id=order_id, user_id=current_user.id).first()
+        expand = _parse_expand(request.args)
+        order = _load_order(current_user.id, order_id)
         
         if not order:
             raise APIException("Orden no encontrada", status_code=404)
         
-        return jsonify(order.serialize()), 200
+        products = _load_order_products(order) if 'product' in expand else None
+        return jsonify(order.serialize(products)), 200
         
     except APIException as e:
         raise e
@@ -569,6 +1243,7 @@ def create_product():
         product_slug = body['name'].lower().replace(' ', '-').replace('ñ', 'n')
         
         product = Product(
+            id=uuid.uuid4(),
             name=body['name'],
             slug=product_slug,
             description=body.get('description'),
@@ -582,6 +1257,7 @@ def create_product():
         )
         
         db.session.add(product)
+        product_changed(product.id)
         db.session.commit()
         
         return jsonify({
@@ -605,11 +1281,24 @@ def update_product(product_id):
         
         body = request.get_json()
         
-        allowed_fields = ['name', 'description', 'short_description', 'price', 'stock_quantity', 'image_url', 'is_active', 'is_featured']
+        allowed_fields = ['name', 'description', 'short_description', 'price', 'image_url', 'is_active', 'is_featured']
         for field in allowed_fields:
             if field in body:
                 setattr(product, field, body[field])
         
+        if 'stock_quantity' in body:
+            try:
+                stock_quantity = int(body['stock_quantity'])
+            except (TypeError, ValueError):
+                raise APIException("Stock inválido", status_code=400)
+            if stock_quantity < 0:
+                raise APIException("Stock inválido", status_code=400)
+            try:
+                set_stock(product, stock_quantity)
+            except ValueError as e:
+                db.session.rollback()
+                raise APIException(f"No se puede reducir el stock: {str(e)}", status_code=400)
+        
         if 'category_id' in body:
             category = Category.query.filter_by(id=body['category_id']).first()
             if not category:
@@ -619,6 +1308,7 @@ def update_product(product_id):
         if 'name' in body:
             product.slug = body['name'].lower().replace(' ', '-').replace('ñ', 'n')
         
+        product_changed(product.id)
         db.session.commit()
         
         return jsonify({
@@ -641,9 +1331,15 @@ def delete_product(product_id):
             raise APIException("Producto no encontrado", status_code=404)
         
         product.is_active = False
+        product_changed(product.id)
         db.session.commit()
         
         return jsonify({"message": "Producto eliminado exitosamente"}), 200
         
     except Exception as e:
-        raise APIException(f"Error al eliminar producto: {str(e)}", status_code=500)
\ No newline at end of file
+        raise APIException(f"Error al eliminar producto: {str(e)}", status_code=500)
+
+@api.route('/admin/cache', methods=['GET'])
+@jwt_required()
+def get_cache_stats():
+    return jsonify(catalog_cache.stats()), 200
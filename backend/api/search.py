@@ -0,0 +1,96 @@
+import re
+
+from sqlalchemy import event, func, inspect, or_, select, table, column, text, DDL
+
+from api.models import db, Product
+
+SEARCH_CONFIG = 'spanish'
+
+FTS5_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "product_id UNINDEXED, name, description, tokenize='unicode61 remove_diacritics 2')"
+)
+
+products_fts = table('products_fts', column('product_id'), column('rank'))
+
+event.listen(Product.__table__, 'after_create', DDL(FTS5_DDL).execute_if(dialect='sqlite'))
+
+
+def search_vector_expression(name, description):
+    return func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(name, '')), 'A').op('||')(
+        func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(description, '')), 'B')
+    )
+
+
+def _fts5_query(term):
+    tokens = re.findall(r'\w+', term, flags=re.UNICODE)
+    return ' '.join('"%s"' % token for token in tokens)
+
+
+def apply_search(query, term):
+    """Filtra `query` por `term` y devuelve (query, orden por relevancia)."""
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, term)
+        rank = func.ts_rank_cd(Product.search_vector, tsquery)
+        return query.filter(Product.search_vector.op('@@')(tsquery)), rank.desc()
+
+    if dialect == 'sqlite':
+        fts_query = _fts5_query(term)
+        if not fts_query:
+            return query.filter(db.false()), None
+        matches = select(products_fts.c.product_id, products_fts.c.rank).where(
+            text('products_fts MATCH :fts_query').bindparams(fts_query=fts_query)
+        ).subquery()
+        query = query.join(matches, matches.c.product_id == Product.id)
+        return query, matches.c.rank.asc()
+
+    query = query.filter(or_(
+        Product.name.ilike(f'%{term}%'),
+        Product.description.ilike(f'%{term}%')
+    ))
+    return query, None
+
+
+def rebuild_search_index(connection):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(
+            Product.__table__.update().values(
+                search_vector=search_vector_expression(Product.__table__.c.name, Product.__table__.c.description)
+            )
+        )
+    elif connection.dialect.name == 'sqlite':
+        connection.execute(text(FTS5_DDL))
+        connection.execute(text("DELETE FROM products_fts"))
+        connection.execute(text(
+            "INSERT INTO products_fts (product_id, name, description) "
+            "SELECT id, name, coalesce(description, '') FROM products"
+        ))
+
+
+def _search_fields_changed(target):
+    state = inspect(target)
+    if not state.has_identity:
+        return True
+    return state.attrs.name.history.has_changes() or state.attrs.description.history.has_changes()
+
+
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _update_search_vector(mapper, connection, target):
+    if connection.dialect.name != 'postgresql' or not _search_fields_changed(target):
+        return
+    target.search_vector = search_vector_expression(target.name, target.description)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_update')
+def _update_fts_row(mapper, connection, target):
+    if connection.dialect.name != 'sqlite' or not _search_fields_changed(target):
+        return
+    connection.execute(text("DELETE FROM products_fts WHERE product_id = :product_id"), {"product_id": target.id.hex})
+    connection.execute(
+        text("INSERT INTO products_fts (product_id, name, description) VALUES (:product_id, :name, :description)"),
+        {"product_id": target.id.hex, "name": target.name, "description": target.description or ''}
+    )
@@ -0,0 +1,128 @@
+import re
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+from sqlalchemy.orm import load_only
+
+from api.models import Product
+from api.invalidation import subscribe
+
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text):
+    """Lowercase words without accents, split on anything but letters and digits.
+
+    Index keys and query prefixes both go through here, so 'anillo-1' is looked up
+    as 'anillo 1' whether it comes from a name, a slug or what the user typed.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.split(r'[\W_]+', text)).strip()
+
+
+class SuggestIndex:
+    """Sorted array of (normalized key, kind, text, product id, slug) searched with bisect.
+
+    Every word of a product name starts a key, so 'plata' finds 'Anillo de plata'.
+    Built by the first suggestion request of each worker, so no other endpoint
+    depends on it, and refreshed per product when the invalidation bus reports a
+    product change.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._by_product = {}
+        self._stale_ids = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _entries_for(self, product):
+        product_id = str(product.id)
+        words = normalize(product.name).split()
+        entries = {(' '.join(words[i:]), 'product', product.name, product_id, product.slug) for i in range(len(words))}
+        entries.add((normalize(product.slug), 'product', product.name, product_id, product.slug))
+        for tag in product.tags or []:
+            entries.add((normalize(tag), 'tag', tag, product_id, None))
+        return sorted(entries)
+
+    def _add(self, product):
+        entries = self._entries_for(product)
+        for entry in entries:
+            insort(self._entries, entry)
+        self._by_product[str(product.id)] = entries
+
+    def _remove(self, product_id):
+        for entry in self._by_product.pop(product_id, []):
+            index = bisect_left(self._entries, entry)
+            if index < len(self._entries) and self._entries[index] == entry:
+                del self._entries[index]
+
+    def _query(self):
+        return Product.query.options(load_only(Product.name, Product.slug, Product.tags)).filter_by(is_active=True)
+
+    def mark_stale(self, product_id=None):
+        with self._lock:
+            if product_id is None:
+                self._loaded = False
+            else:
+                self._stale_ids.add(product_id)
+
+    def refresh(self):
+        with self._lock:
+            if not self._loaded:
+                products = self._query().all()
+                self._entries = []
+                self._by_product = {}
+                self._stale_ids.clear()
+                for product in products:
+                    entries = self._entries_for(product)
+                    self._entries.extend(entries)
+                    self._by_product[str(product.id)] = entries
+                self._entries.sort()
+                self._loaded = True
+            elif self._stale_ids:
+                stale_ids = list(self._stale_ids)
+                self._stale_ids.clear()
+                for product_id in stale_ids:
+                    self._remove(product_id)
+                for product in self._query().filter(Product.id.in_(stale_ids)).all():
+                    self._add(product)
+
+    def suggest(self, prefix, limit=8):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.refresh()
+
+        suggestions = []
+        seen = set()
+        with self._lock:
+            index = bisect_left(self._entries, (prefix,))
+            while index < len(self._entries) and len(suggestions) < limit:
+                key, kind, text, product_id, slug = self._entries[index]
+                if not key.startswith(prefix):
+                    break
+                index += 1
+                identity = (kind, product_id if kind == 'product' else normalize(text))
+                if identity in seen:
+                    continue
+                seen.add(identity)
+                if kind == 'product':
+                    suggestions.append({"type": kind, "text": text, "product_id": product_id, "slug": slug})
+                else:
+                    suggestions.append({"type": kind, "text": text})
+        return suggestions
+
+
+suggest_index = SuggestIndex()
+
+
+@subscribe
+def _on_invalidation(namespace, ident):
+    if namespace == 'product' and ident:
+        suggest_index.mark_stale(ident)
+    elif namespace in (None, 'product'):
+        suggest_index.mark_stale()
+
@@ -1,3 +1,6 @@
+import base64
+import json
+from datetime import datetime
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -30,4 +33,18 @@ def generate_sitemap(app):
             links.append(url)
 
     # links is now a list of url, endpoint tuples
-    return jsonify(links)
\ No newline at end of file
+    return jsonify(links)
+
+def encode_cursor(*values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else str(value) for value in values])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size=2):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        raise APIException("Cursor inválido", status_code=400)
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(value, str) for value in values):
+        raise APIException("Cursor inválido", status_code=400)
+    return values
@@ -11,6 +11,11 @@ from api.utils import APIException, generate_sitemap
 from api.models import db, User
 from api.routes import api
 from api.admin import setup_admin
+from api.benchmarks import setup_benchmarks
+from api.invalidation import setup_invalidation
+from api.inventory import setup_inventory
+from api.idempotency import setup_idempotency
+from api.outbox import setup_outbox
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -32,12 +37,17 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-string-change-in-production')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False
 
-CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True, allow_headers="*", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"])
+CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True, allow_headers="*", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
 
 jwt = JWTManager(app)
 MIGRATE = Migrate(app, db, compare_type=True)
 db.init_app(app)
 setup_admin(app)
+setup_benchmarks(app)
+setup_invalidation(app)
+setup_inventory(app)
+setup_idempotency(app)
+setup_outbox(app)
 app.register_blueprint(api, url_prefix='/api')
 
 @jwt.user_identity_loader
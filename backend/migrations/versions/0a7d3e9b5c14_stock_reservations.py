@@ -0,0 +1,47 @@
+"""stock reservations held between payment intent and confirmation
+
+Revision ID: 0a7d3e9b5c14
+Revises: f6b2c8d1e937
+Create Date: 2026-10-17 15:32:08.114870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '0a7d3e9b5c14'
+down_revision = 'f6b2c8d1e937'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reserved_quantity', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('stock_reservations',
+    sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('product_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_reservations_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_reservations_user_id'), ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stock_reservations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_reservations_user_id'))
+        batch_op.drop_index(batch_op.f('ix_stock_reservations_expires_at'))
+
+    op.drop_table('stock_reservations')
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('reserved_quantity')
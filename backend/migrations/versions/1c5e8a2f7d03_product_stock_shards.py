@@ -0,0 +1,42 @@
+"""sharded stock counters for flash-sale products
+
+Revision ID: 1c5e8a2f7d03
+Revises: 0a7d3e9b5c14
+Create Date: 2026-10-17 16:48:37.501926
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '1c5e8a2f7d03'
+down_revision = '0a7d3e9b5c14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock_shards', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('product_stock_shards',
+    sa.Column('product_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('shard', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['products.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('product_id', 'shard')
+    )
+
+
+def downgrade():
+    op.execute("""
+        UPDATE products SET stock_quantity = (
+            SELECT COALESCE(SUM(quantity), 0) FROM product_stock_shards WHERE product_id = products.id
+        )
+        WHERE stock_shards > 0
+    """)
+    op.drop_table('product_stock_shards')
+
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('stock_shards')
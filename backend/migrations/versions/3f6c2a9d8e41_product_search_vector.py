@@ -0,0 +1,52 @@
+"""product full-text search vector
+
+Revision ID: 3f6c2a9d8e41
+Revises: 89184dcc3b39
+Create Date: 2026-10-17 10:12:40.518233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2a9d8e41'
+down_revision = '89184dcc3b39'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.execute(
+            "UPDATE products SET search_vector = "
+            "setweight(to_tsvector('spanish', coalesce(name, '')), 'A') || "
+            "setweight(to_tsvector('spanish', coalesce(description, '')), 'B')"
+        )
+        with op.get_context().autocommit_block():
+            op.create_index('ix_products_search_vector', 'products', ['search_vector'],
+                            postgresql_using='gin', postgresql_concurrently=True)
+    elif bind.dialect.name == 'sqlite':
+        op.add_column('products', sa.Column('search_vector', sa.Text(), nullable=True))
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+            "product_id UNINDEXED, name, description, tokenize='unicode61 remove_diacritics 2')"
+        )
+        op.execute(
+            "INSERT INTO products_fts (product_id, name, description) "
+            "SELECT id, name, coalesce(description, '') FROM products"
+        )
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.drop_index('ix_products_search_vector', table_name='products', postgresql_concurrently=True)
+    elif bind.dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS products_fts")
+    with op.batch_alter_table('products', schema=None) as batch_op:
+        batch_op.drop_column('search_vector')
@@ -0,0 +1,34 @@
+"""stripe payment intent reused per user while the cart is unchanged
+
+Revision ID: 4b7d2e9a6c15
+Revises: 3e8a1f5c7b24
+Create Date: 2026-10-17 19:36:44.208513
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '4b7d2e9a6c15'
+down_revision = '3e8a1f5c7b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('checkout_intents',
+    sa.Column('user_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('intent_id', sa.String(length=255), nullable=False),
+    sa.Column('client_secret', sa.String(length=255), nullable=False),
+    sa.Column('cart_hash', sa.String(length=64), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.Column('currency', sa.String(length=3), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+
+def downgrade():
+    op.drop_table('checkout_intents')
@@ -0,0 +1,34 @@
+"""cache invalidations table for the polling bus
+
+Revision ID: b7d41e0c5a92
+Revises: 3f6c2a9d8e41
+Create Date: 2026-10-17 11:03:27.904116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e0c5a92'
+down_revision = '3f6c2a9d8e41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_invalidations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('keys', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('cache_invalidations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_cache_invalidations_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('cache_invalidations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cache_invalidations_created_at'))
+
+    op.drop_table('cache_invalidations')
@@ -0,0 +1,49 @@
+"""indexes for the hot query shapes
+
+Revision ID: c2e8f1a47b36
+Revises: b7d41e0c5a92
+Create Date: 2026-10-17 11:48:52.217604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e8f1a47b36'
+down_revision = 'b7d41e0c5a92'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns, partial predicate on Postgres, partial predicate on SQLite)
+# categories.slug lookups are already served by the unique index on slug.
+INDEXES = [
+    ('ix_products_active_created', 'products', ['created_at', 'id'],
+     'is_active', 'is_active = 1'),
+    ('ix_products_category_active_created', 'products', ['category_id', 'created_at', 'id'],
+     'is_active', 'is_active = 1'),
+    ('ix_products_featured_created', 'products', ['created_at', 'id'],
+     'is_active AND is_featured', 'is_active = 1 AND is_featured = 1'),
+    ('ix_cart_items_user_product', 'cart_items', ['user_id', 'product_id'], None, None),
+    ('ix_orders_user_created', 'orders', ['user_id', 'created_at'], None, None),
+    ('ix_order_items_order', 'order_items', ['order_id'], None, None),
+    ('ix_categories_active_sort', 'categories', ['sort_order', 'name'],
+     'is_active', 'is_active = 1'),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, and it only takes
+    # a SHARE UPDATE EXCLUSIVE lock, so reads and writes keep flowing meanwhile.
+    with op.get_context().autocommit_block():
+        for name, table, columns, postgresql_where, sqlite_where in INDEXES:
+            op.create_index(name, table, columns, unique=False, if_not_exists=True,
+                            postgresql_concurrently=True,
+                            postgresql_where=sa.text(postgresql_where) if postgresql_where else None,
+                            sqlite_where=sa.text(sqlite_where) if sqlite_where else None)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, *_ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,50 @@
+"""category materialized path
+
+Revision ID: d94a7c3e2f18
+Revises: c2e8f1a47b36
+Create Date: 2026-10-17 12:31:05.662970
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd94a7c3e2f18'
+down_revision = 'c2e8f1a47b36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('path', sa.String(length=1024).with_variant(sa.String(length=1024, collation='NOCASE'), 'sqlite'), nullable=True))
+
+    # Ids are stored as 32 hex characters in the path, the same as uuid.UUID.hex.
+    if op.get_bind().dialect.name == 'postgresql':
+        def hex_id(column):
+            return f"replace(CAST({column} AS TEXT), '-', '')"
+    else:
+        def hex_id(column):
+            return column
+
+    op.execute(
+        "WITH RECURSIVE tree (id, path) AS ("
+        f" SELECT id, '/' || {hex_id('id')} || '/' FROM categories WHERE parent_id IS NULL"
+        " UNION ALL"
+        f" SELECT c.id, t.path || {hex_id('c.id')} || '/' FROM categories c JOIN tree t ON c.parent_id = t.id"
+        ")"
+        " UPDATE categories SET path = (SELECT tree.path FROM tree WHERE tree.id = categories.id)"
+    )
+
+    with op.get_context().autocommit_block():
+        op.create_index('ix_categories_path', 'categories', ['path'], unique=False, if_not_exists=True,
+                        postgresql_ops={'path': 'text_pattern_ops'}, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_categories_path', table_name='categories', if_exists=True, postgresql_concurrently=True)
+
+    with op.batch_alter_table('categories', schema=None) as batch_op:
+        batch_op.drop_column('path')
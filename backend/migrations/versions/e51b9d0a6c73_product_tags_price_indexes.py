@@ -0,0 +1,33 @@
+"""product tags and price indexes
+
+Revision ID: e51b9d0a6c73
+Revises: d94a7c3e2f18
+Create Date: 2026-10-17 13:20:44.180592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e51b9d0a6c73'
+down_revision = 'd94a7c3e2f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_products_active_price', 'products', ['price', 'id'], unique=False, if_not_exists=True,
+                        postgresql_concurrently=True,
+                        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active = 1'))
+        if op.get_bind().dialect.name == 'postgresql':
+            op.create_index('ix_products_tags', 'products', ['tags'], unique=False, if_not_exists=True,
+                            postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        if op.get_bind().dialect.name == 'postgresql':
+            op.drop_index('ix_products_tags', table_name='products', if_exists=True, postgresql_concurrently=True)
+        op.drop_index('ix_products_active_price', table_name='products', if_exists=True, postgresql_concurrently=True)
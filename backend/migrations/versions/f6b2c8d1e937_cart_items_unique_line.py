@@ -0,0 +1,61 @@
+"""one cart line per user, product and variant
+
+Revision ID: f6b2c8d1e937
+Revises: e51b9d0a6c73
+Create Date: 2026-10-17 14:05:12.640218
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b2c8d1e937'
+down_revision = 'e51b9d0a6c73'
+branch_labels = None
+depends_on = None
+
+SAME_LINE = """
+    other.user_id = cart_items.user_id
+    AND other.product_id = cart_items.product_id
+    AND (other.product_variant_id = cart_items.product_variant_id
+         OR (other.product_variant_id IS NULL AND cart_items.product_variant_id IS NULL))
+"""
+
+
+def upgrade():
+    # Concurrent adds could create duplicate lines: fold them into the oldest row
+    # (by created_at, then id) before the unique indexes go in.
+    op.execute(f"""
+        UPDATE cart_items SET quantity = (
+            SELECT SUM(other.quantity) FROM cart_items other WHERE {SAME_LINE}
+        )
+        WHERE EXISTS (SELECT 1 FROM cart_items other WHERE {SAME_LINE} AND other.id <> cart_items.id)
+    """)
+    op.execute(f"""
+        DELETE FROM cart_items
+        WHERE EXISTS (
+            SELECT 1 FROM cart_items other WHERE {SAME_LINE}
+            AND (COALESCE(other.created_at, '1970-01-01'), other.id)
+                < (COALESCE(cart_items.created_at, '1970-01-01'), cart_items.id)
+        )
+    """)
+
+    # Built concurrently like the other indexes, so carts stay writable meanwhile.
+    # NULL variants never conflict in a plain unique index, hence one partial index each.
+    with op.get_context().autocommit_block():
+        op.create_index('uq_cart_items_user_product', 'cart_items', ['user_id', 'product_id'], unique=True,
+                        postgresql_concurrently=True,
+                        postgresql_where=sa.text('product_variant_id IS NULL'),
+                        sqlite_where=sa.text('product_variant_id IS NULL'))
+        op.create_index('uq_cart_items_user_product_variant', 'cart_items',
+                        ['user_id', 'product_id', 'product_variant_id'], unique=True,
+                        postgresql_concurrently=True,
+                        postgresql_where=sa.text('product_variant_id IS NOT NULL'),
+                        sqlite_where=sa.text('product_variant_id IS NOT NULL'))
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('uq_cart_items_user_product_variant', table_name='cart_items', postgresql_concurrently=True)
+        op.drop_index('uq_cart_items_user_product', table_name='cart_items', postgresql_concurrently=True)
@@ -44,7 +44,7 @@ export const useApi = () => {
   };
 
   const orders = {
-    getAll: () => callApi(apiService.getOrders),
+    getAll: (cursor) => callApi(apiService.getOrders, cursor),
     getById: (id) => callApi(apiService.getOrder, id)
   };
 
@@ -22,6 +22,9 @@ const MyOrders = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [selectedOrder, setSelectedOrder] = useState(null);
+  const [orderDetails, setOrderDetails] = useState({});
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     loadOrders();
@@ -33,7 +36,8 @@ const MyOrders = () => {
       setError('');
       
       const response = await ordersAPI.getOrders();
-      setOrders(response.data || response);
+      setOrders(response.data?.orders || []);
+      setNextCursor(response.data?.pagination?.next_cursor || null);
     } catch (error) {
       console.error('Error loading orders:', error);
       setError(handleAPIError(error));
@@ -42,6 +46,37 @@ const MyOrders = () => {
     }
   };
 
+  const loadMoreOrders = async () => {
+    try {
+      setLoadingMore(true);
+      const response = await ordersAPI.getOrders(nextCursor);
+      setOrders((current) => [...current, ...(response.data?.orders || [])]);
+      setNextCursor(response.data?.pagination?.next_cursor || null);
+    } catch (error) {
+      console.error('Error loading orders:', error);
+      setError(handleAPIError(error));
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // The list only has summaries; the items are fetched when an order is opened
+  const toggleOrder = async (orderId) => {
+    if (selectedOrder === orderId) {
+      setSelectedOrder(null);
+      return;
+    }
+    setSelectedOrder(orderId);
+    if (orderDetails[orderId]) return;
+    try {
+      const response = await ordersAPI.getOrder(orderId);
+      setOrderDetails((current) => ({ ...current, [orderId]: response.data }));
+    } catch (error) {
+      console.error('Error loading order:', error);
+      setError(handleAPIError(error));
+    }
+  };
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'pending':
@@ -196,7 +231,7 @@ const MyOrders = () => {
                       </span>
                       
                       <button
-                        onClick={() => setSelectedOrder(selectedOrder === order.id ? null : order.id)}
+                        onClick={() => toggleOrder(order.id)}
                         className="flex items-center space-x-2 px-4 py-2 text-primary-600 hover:bg-primary-50 rounded-lg transition-colors"
                       >
                         <Eye className="w-4 h-4" />
@@ -231,7 +266,7 @@ const MyOrders = () => {
                       <div>
                         <div className="text-sm text-secondary-600">Productos</div>
                         <div className="text-lg font-semibold text-secondary-900">
-                          {order.order_items?.length || 0} items
+                          {order.item_count ?? order.order_items?.length ?? 0} items
                         </div>
                       </div>
                     </div>
@@ -262,21 +297,26 @@ const MyOrders = () => {
                   <div className="border-t border-secondary-200 p-6 bg-secondary-50">
                     <h4 className="text-lg font-semibold text-secondary-900 mb-4">Productos del pedido</h4>
                     
-                    {order.order_items && order.order_items.length > 0 ? (
+                    {!orderDetails[order.id] ? (
+                      <div className="text-center py-8">
+                        <RefreshCw className="w-8 h-8 text-secondary-300 mx-auto mb-2 animate-spin" />
+                        <p className="text-secondary-600">Cargando productos...</p>
+                      </div>
+                    ) : orderDetails[order.id].order_items?.length > 0 ? (
                       <div className="space-y-4">
-                        {order.order_items.map((item, index) => (
+                        {orderDetails[order.id].order_items.map((item, index) => (
                           <div key={index} className="bg-white rounded-lg p-4 flex items-center justify-between">
                             <div className="flex items-center space-x-4">
-                              {item.product?.image_url && (
+                              {item.product_snapshot?.image_url && (
                                 <img
-                                  src={item.product.image_url}
-                                  alt={item.product_name || item.product?.name}
+                                  src={item.product_snapshot.image_url}
+                                  alt={item.product_snapshot.name}
                                   className="w-16 h-16 object-cover rounded-lg"
                                 />
                               )}
                               <div>
                                 <h5 className="font-medium text-secondary-900">
-                                  {item.product_name || item.product?.name || 'Producto'}
+                                  {item.product_snapshot?.name || 'Producto'}
                                 </h5>
                                 <p className="text-sm text-secondary-600">
                                   Cantidad: {item.quantity}
@@ -324,6 +364,18 @@ const MyOrders = () => {
                 )}
               </div>
             ))}
+
+            {nextCursor && (
+              <div className="text-center">
+                <button
+                  onClick={loadMoreOrders}
+                  disabled={loadingMore}
+                  className="px-6 py-3 text-primary-600 hover:bg-primary-50 rounded-lg transition-colors font-medium disabled:opacity-50"
+                >
+                  {loadingMore ? 'Cargando...' : 'Cargar más pedidos'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
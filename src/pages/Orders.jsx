@@ -8,6 +8,10 @@ const Orders = () => {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [selectedOrder, setSelectedOrder] = useState(null);
+  const [orderDetails, setOrderDetails] = useState({});
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
 
   useEffect(() => {
     fetchOrders();
@@ -16,8 +20,10 @@ const Orders = () => {
   const fetchOrders = async () => {
     try {
       setLoading(true);
+      setError(null);
       const ordersData = await apiService.getOrders();
-      setOrders(ordersData);
+      setOrders(ordersData.orders || []);
+      setNextCursor(ordersData.pagination?.next_cursor || null);
     } catch (err) {
       setError(err.response?.data?.message || 'Error al cargar las órdenes');
     } finally {
@@ -25,6 +31,35 @@ const Orders = () => {
     }
   };
 
+  const fetchMoreOrders = async () => {
+    try {
+      setLoadingMore(true);
+      const ordersData = await apiService.getOrders(nextCursor);
+      setOrders((current) => [...current, ...(ordersData.orders || [])]);
+      setNextCursor(ordersData.pagination?.next_cursor || null);
+    } catch (err) {
+      setError(err.response?.data?.message || 'Error al cargar las órdenes');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
+  // The list only has summaries; the items are fetched when an order is opened
+  const toggleOrder = async (orderId) => {
+    if (selectedOrder === orderId) {
+      setSelectedOrder(null);
+      return;
+    }
+    setSelectedOrder(orderId);
+    if (orderDetails[orderId]) return;
+    try {
+      const order = await apiService.getOrder(orderId);
+      setOrderDetails((current) => ({ ...current, [orderId]: order }));
+    } catch (err) {
+      setError(err.response?.data?.message || 'Error al cargar la orden');
+    }
+  };
+
   const getStatusColor = (status) => {
     const colors = {
       pending: 'bg-yellow-100 text-yellow-800',
@@ -119,7 +154,7 @@ const Orders = () => {
                   <div className="flex justify-between items-start mb-4">
                     <div>
                       <h3 className="text-lg font-semibold text-gray-900">
-                        Orden #{order.id}
+                        Orden #{order.order_number || order.id}
                       </h3>
                       <p className="text-gray-500">
                         {formatDate(order.created_at)}
@@ -144,30 +179,34 @@ const Orders = () => {
                         </p>
                       </div>
                       <div>
-                        <h4 className="font-medium text-gray-900 mb-1">ID de Pago</h4>
-                        <p className="text-gray-600 text-sm font-mono">
-                          {order.stripe_payment_intent_id || 'N/A'}
+                        <h4 className="font-medium text-gray-900 mb-1">Productos</h4>
+                        <p className="text-gray-600 text-sm">
+                          {order.item_count} {order.item_count === 1 ? 'producto' : 'productos'}
                         </p>
                       </div>
                     </div>
 
-                    {order.order_items && order.order_items.length > 0 && (
+                    {selectedOrder === order.id && !orderDetails[order.id] && (
+                      <p className="text-gray-500 text-sm">Cargando productos...</p>
+                    )}
+
+                    {selectedOrder === order.id && orderDetails[order.id]?.order_items?.length > 0 && (
                       <div>
                         <h4 className="font-medium text-gray-900 mb-2">Productos</h4>
                         <div className="space-y-2">
-                          {order.order_items.map((item) => (
+                          {orderDetails[order.id].order_items.map((item) => (
                             <div key={item.id} className="flex justify-between items-center py-2 border-b border-gray-100 last:border-b-0">
                               <div className="flex items-center">
-                                {item.product?.image_url && (
+                                {item.product_snapshot?.image_url && (
                                   <img
-                                    src={item.product.image_url}
-                                    alt={item.product.name}
+                                    src={item.product_snapshot.image_url}
+                                    alt={item.product_snapshot.name}
                                     className="w-12 h-12 object-cover rounded mr-3"
                                   />
                                 )}
                                 <div>
                                   <p className="font-medium text-gray-900">
-                                    {item.product?.name || 'Producto eliminado'}
+                                    {item.product_snapshot?.name || 'Producto'}
                                   </p>
                                   <p className="text-gray-500 text-sm">
                                     Cantidad: {item.quantity}
@@ -190,12 +229,12 @@ const Orders = () => {
                   </div>
 
                   <div className="mt-4 flex justify-between items-center">
-                    <Link
-                      to={`/orders/${order.id}`}
+                    <button
+                      onClick={() => toggleOrder(order.id)}
                       className="text-blue-600 hover:text-blue-700 font-medium"
                     >
-                      Ver detalles →
-                    </Link>
+                      {selectedOrder === order.id ? 'Ocultar detalles' : 'Ver detalles →'}
+                    </button>
                     
                     {order.status === 'delivered' && (
                       <button className="bg-green-600 text-white px-4 py-2 rounded hover:bg-green-700 transition-colors">
@@ -206,6 +245,18 @@ const Orders = () => {
                 </div>
               </div>
             ))}
+
+            {nextCursor && (
+              <div className="text-center">
+                <button
+                  onClick={fetchMoreOrders}
+                  disabled={loadingMore}
+                  className="px-6 py-3 text-blue-600 hover:bg-blue-50 rounded-lg transition-colors font-medium disabled:opacity-50"
+                >
+                  {loadingMore ? 'Cargando...' : 'Cargar más órdenes'}
+                </button>
+              </div>
+            )}
           </div>
         )}
       </div>
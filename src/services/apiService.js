@@ -111,8 +111,8 @@ class ApiService {
     return response.data;
   }
 
-  async getOrders() {
-    const response = await this.api.get('/orders');
+  async getOrders(cursor) {
+    const response = await this.api.get('/orders', { params: cursor ? { cursor } : {} });
     return response.data;
   }
 
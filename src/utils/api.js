@@ -81,7 +81,7 @@ export const paymentsAPI = {
 };
 
 export const ordersAPI = {
-  getOrders: () => api.get('/orders'),
+  getOrders: (cursor) => api.get('/orders', { params: cursor ? { cursor } : {} }),
   getOrder: (id) => api.get(`/orders/${id}`),
 };
 